@@ -10,6 +10,7 @@ syntax errors.
 
 Usage: python check.py filename1 [filename2 ...]
        python check.py *
+       python check.py --jobs <jobs> --json <directory> [...]
 
 Errors:
   [BAD PROBLEM HEADER] - Problem header was not formatted correctly.
@@ -21,102 +22,234 @@ Errors:
   [NO DOUBLE-QUOTED STRINGS] - Strings must be enclosed by SINGLE quotes.
 """
 
+import argparse
+import json
+import multiprocessing
 import os
 import re
-import sys
 
-MAX_LINE_LENGTH = 80
+# ------------------------------- Style Rules ------------------------------- #
+# The grader applies these same rules (see src/stylerules.py), so this file has
+# to stay self-contained: it is handed out to students on its own. Every match
+# of a rule has to contain a literal string (like a comma, or a tab), so a
+# rule's regular expression only runs on lines that contain it; most lines are
+# only scanned by fast substring checks.
 
-S                   = r"[^\>\<\=\(\) \t\n\r\f\v]"
+MAX_LINE_LENGTH = 80
 
+# The patterns looked for in each line.
 header              = re.compile(r"-- \[Problem (([0-9])+([a-zA-Z])*|[a-zA-Z])\]")
 bad_header          = re.compile(r"-- \[Problem([^\]])*\]")
 comment             = re.compile(r"\s*--.|/\*.|\*/.")
-tabs                = re.compile(r"\t+")
 comma_space         = re.compile(r",[^ ][^\n]")
-negative_num        = re.compile(r"\-([0-9]*\.?[0-9]+)")
-count_star          = re.compile(r"\(\*\)|\(DISTINCT \*\)")
 double_quote        = re.compile(r"\"([^\"])*\"")
-HAS_HEADER = False
-MULTILINE_COMMENT = False
 
-def check_line(line, line_number):
+# The violations a line can have. The names are the same as the StyleErrors
+# they correspond to.
+BAD_HEADER = "BAD_HEADER"
+CODE_BEFORE_PROBLEM_HEADER = "CODE_BEFORE_PROBLEM_HEADER"
+DOUBLE_QUOTES = "DOUBLE_QUOTES"
+LINE_TOO_LONG = "LINE_TOO_LONG"
+SPACING = "SPACING"
+USED_TABS = "USED_TABS"
+
+def is_comment(line):
+  """
+  Function: is_comment
+  --------------------
+  Checks whether a line contains a comment.
+
+  line: The line to check.
+  returns: True if the line contains a comment.
+  """
+  return (("--" in line or "/*" in line or "*/" in line) and
+          comment.search(line) is not None)
+
+class RuleChecker:
+  """
+  Class: RuleChecker
+  ------------------
+  Checks the lines of a single file against the style rules. Keeps track of
+  whether a problem header has been seen yet and whether the current line is in
+  a block comment, so a new checker should be used for each file.
+  """
+
+  def __init__(self):
+    # Whether or not a problem header has been encountered.
+    self.has_header = False
+
+    # If in a multi-line comment.
+    self.multiline_comment = False
+
+
+  def check_line(self, line):
+    """
+    Function: check_line
+    --------------------
+    Checks the next line of the file for style violations.
+
+    line: The line to check, without its newline.
+    returns: A list of the violations in the line.
+    """
+    stripped = line.strip()
+    if not len(stripped):
+      return []
+
+    violations = []
+
+    # Check for problem header formatting errors (cannot have code before a
+    # problem header).
+    is_header = "-- [Problem" in line and header.search(line) is not None
+    if is_header:
+      self.has_header = True
+    if stripped.startswith("/*"):
+      self.multiline_comment = True
+
+    # Check for style mistakes.
+    is_bad_header = (not is_header and "-- [Problem" in line and
+                     bad_header.search(line) is not None)
+    if is_bad_header:
+      violations.append(BAD_HEADER)
+    if "\t" in line:
+      violations.append(USED_TABS)
+    if len(line) > MAX_LINE_LENGTH:
+      violations.append(LINE_TOO_LONG)
+    if (not self.multiline_comment and ("," in line or "\"" in line) and
+        not is_comment(line)):
+      if "," in line and comma_space.search(line):
+        violations.append(SPACING)
+      if "\"" in line and double_quote.search(line):
+        violations.append(DOUBLE_QUOTES)
+
+    # Continue checking for problem header mistakes.
+    if not (self.has_header or
+            self.multiline_comment or
+            is_bad_header or
+            is_comment(stripped)):
+      violations.append(CODE_BEFORE_PROBLEM_HEADER)
+    if stripped.startswith("*/") or stripped.endswith("*/"):
+      self.multiline_comment = False
+    return violations
+
+# ------------------------------ Style Checker ------------------------------ #
+
+# The message printed for each violation.
+MESSAGES = {
+  BAD_HEADER: "[BAD PROBLEM HEADER]",
+  CODE_BEFORE_PROBLEM_HEADER: "[CODE BEFORE PROBLEM HEADER]",
+  DOUBLE_QUOTES: "[NO DOUBLE-QUOTED STRINGS]",
+  LINE_TOO_LONG: "[LINE TOO LONG (%d CHARS)]",
+  SPACING: "[PUT SPACE AFTER COMMA]",
+  USED_TABS: "[DO NOT USE TABS]"
+}
+
+def check_file(filename):
+  """
+  Function: check_file
+  --------------------
+  Checks a file for style violations.
+
+  filename: The name of the file to check.
+  returns: A dict with the name of the file ("file"), whether or not it is in
+           UTF-8 ("utf8") and its violations ("violations"), each a dict with
+           the line number ("line"), the violation ("violation") and the line
+           itself ("text").
+  """
+  f = open(filename, 'r')
+  lines = f.readlines()
+  f.close()
+  result = {"file": filename, "utf8": True, "violations": []}
+
+  # Check for encoding.
+  try:
+    "\n".join(lines).decode('utf-8')
+  except UnicodeDecodeError:
+    result["utf8"] = False
+    return result
+
+  rules = RuleChecker()
+  for i in range(len(lines)):
+    line = lines[i][:-1]
+    for violation in rules.check_line(line):
+      result["violations"].append({"line": i + 1, "violation": violation,
+                                   "text": line})
+  return result
+
+
+def find_files(paths):
   """
-  Function: check_line
+  Function: find_files
   --------------------
-  Checks a line of a file for style violations.
+  Finds the SQL files to check. Directories are searched for SQL files.
+
+  paths: The files and directories to check.
+  returns: The files to check, in order.
   """
-  global HAS_HEADER, MULTILINE_COMMENT
-  is_bad_header = False
+  files = []
+  for path in paths:
+    if os.path.isdir(path):
+      for (directory, _, filenames) in sorted(os.walk(path)):
+        files += [os.path.join(directory, f) for f in sorted(filenames)
+                  if f.endswith(".sql")]
+    else:
+      files.append(path)
+  return files
 
-  def h():
-    return "Line %d " % (line_number)
 
-  def f(line):
-    return ":\n  %s" % line.strip()
+def print_result(result):
+  """
+  Function: print_result
+  ----------------------
+  Prints the violations in a file.
 
-  if not len(line.strip()):
+  result: The result of checking the file.
+  """
+  print "\n", result["file"]
+  print "-" * len(result["file"])
+  if not result["utf8"]:
+    print "FILE IS NOT IN UTF-8 ENCODING!"
     return
 
-  # Check for problem header formatting errors (cannot have code before a
-  # problem header).
-  if not HAS_HEADER and header.search(line):
-    HAS_HEADER = True
-  if line.strip().startswith("/*"):
-    MULTILINE_COMMENT = True
-
-  # Check for style mistakes.
-  if bad_header.search(line) and not header.search(line):
-    print h() + "[BAD PROBLEM HEADER]" + f(line)
-    is_bad_header = True
-  if tabs.search(line):
-    print h() + "[DO NOT USE TABS]" + f(line)
-  if len(line) > MAX_LINE_LENGTH:
-    print h() + "[LINE TOO LONG (" + str(len(line)) + " CHARS)]" + f(line)
-  if not MULTILINE_COMMENT and not comment.search(line):
-    if comma_space.search(line):
-      print h() + "[PUT SPACE AFTER COMMA]" + f(line)
-    if double_quote.search(line):
-      print h() + "[NO DOUBLE-QUOTED STRINGS]" + f(line)
-
-  # Continue checking for problem header mistakes.
-  if not (HAS_HEADER or
-          MULTILINE_COMMENT or
-          is_bad_header or
-          comment.search(line.strip())):
-    print h() + "[CODE BEFORE PROBLEM HEADER]" + f(line)
-  if line.strip().startswith("*/") or line.strip().endswith("*/"):
-    MULTILINE_COMMENT = False
+  for violation in result["violations"]:
+    message = MESSAGES[violation["violation"]]
+    if violation["violation"] == LINE_TOO_LONG:
+      message = message % len(violation["text"])
+    print "Line %d %s:\n  %s" % (violation["line"], message,
+                                 violation["text"].strip())
 
 
 if __name__ == '__main__':
   # Main program.
-  if len(sys.argv) < 2:
-    print "\nUsage: check.py filename1 [filename2 ...] OR\n" + \
-          "       check.py *"
-    sys.exit()
+  parser = argparse.ArgumentParser(
+    description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("files", nargs="+",
+                      help="Files (or directories of files) to check, or * "
+                           "for every SQL file in this directory")
+  parser.add_argument("--jobs", type=int, default=1,
+                      help="Number of files to check in parallel")
+  parser.add_argument("--json", action="store_const", const=True,
+                      help="Print the violations as JSON")
+  args = parser.parse_args()
 
-  files = []
   # If checking all SQL files.
-  if sys.argv[1] == '*':
-    files = [f for f in os.listdir(".") if f.endswith(".sql")]
+  if args.files == ['*']:
+    files = sorted([f for f in os.listdir(".") if f.endswith(".sql")])
 
   # If checking specific files.
-  else: files = sys.argv[1:]
-
-  for filename in files:
-    f = open(filename, 'r')
-    lines = f.readlines()
-    f.close()
-    print "\n", filename
-    print "-" * len(filename)
-    # Check for encoding.
-    try:
-      "\n".join(lines).decode('utf-8')
-    except UnicodeDecodeError:
-      print "FILE IS NOT IN UTF-8 ENCODING!"
-      continue
-
-    for i in range(len(lines)):
-      line = lines[i][:-1]
-      check_line(line, i + 1)
+  else: files = find_files(args.files)
+
+  if args.jobs > 1:
+    pool = multiprocessing.Pool(args.jobs)
+    results = pool.imap(check_file, files, 16)
+  else:
+    results = (check_file(filename) for filename in files)
+
+  if args.json:
+    print json.dumps(list(results), indent=2)
+  else:
+    for result in results:
+      print_result(result)
+
+  if args.jobs > 1:
+    pool.close()
+    pool.join()
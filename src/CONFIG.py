@@ -31,6 +31,27 @@ CONNECTION_TIMEOUT = 30
 # Maximum timeout for any query.
 MAX_TIMEOUT = 600
 
+# Once a test's solution query has been run, the deadline for students' queries
+# in the test is this many times the slowest of its last TIMING_HISTORY
+# runtimes, but at least MIN_TIMEOUT and at most MAX_TIMEOUT seconds. The
+# timeout in the specs (or CONNECTION_TIMEOUT) is still the shortest deadline
+# used. Set to None to always use the timeouts in the specs.
+TIMEOUT_MULTIPLE = 20
+MIN_TIMEOUT = CONNECTION_TIMEOUT
+TIMING_HISTORY = 20
+
+# Maximum number of row combinations MySQL may estimate a student's SELECT
+# statement will examine (its max_join_size) before refusing to run it, which
+# stops runaway cross joins. Set to None to not limit it.
+MAX_JOIN_SIZE = 10 ** 10
+
+# If set, students' queries are checked with EXPLAIN before they are run. A
+# query MySQL estimates will examine more than this many times the rows the
+# solution examines (counted as at least EXPLAIN_MIN_ROWS) is not run, and fails
+# the test as if it timed out. Set to None to not check queries.
+EXPLAIN_COST_MULTIPLE = None
+EXPLAIN_MIN_ROWS = 10000
+
 # ------------------------------ Grading Config ------------------------------ #
 
 # Directory where all the assignment specs and student files are stored.
@@ -39,6 +60,18 @@ ASSIGNMENT_DIR = "../assignments/"
 # Directory where results an assignment are stored.
 RESULT_DIR = "_results/"
 
+# Database within RESULT_DIR where each student's graded output is stored, so
+# it can be queried and unchanged submissions need not be graded again.
+RESULT_STORE = "results.db"
+
+# File within RESULT_DIR that each student's graded output is appended to as
+# soon as they are graded, so that an interrupted run can be resumed.
+JOURNAL_FILE = "journal.jsonl"
+
+# File in the results directory with the history of how long each test's
+# solution query takes to run.
+TIMING_STORE = "timings.json"
+
 # Directory within ASSIGNMENT_DIR where the student files are stored.
 STUDENT_DIR = "students/"
 
@@ -56,8 +89,33 @@ MATH_JAX = "http://cdn.mathjax.org/mathjax/latest/MathJax.js?" + \
 # Directory where the output files for the students are stored.
 STUDENT_OUTPUT_DIR = "student_output/"
 
+# Number of students whose files are read and parsed ahead of time while the
+# current student is being graded.
+PREFETCH_DEPTH = 4
+
+# Number of parsed files kept so files that are identical across students are
+# only parsed once.
+PARSED_FILES_SIZE = 256
+
+# Number of background threads rendering the HTML output for graded students,
+# and the number of graded students that can wait to be rendered.
+RENDER_WORKERS = 2
+RENDER_QUEUE_SIZE = 16
+
+# Database file storing the graded output of previously-seen responses. Shared
+# between assignments (and semesters) so returning answers need not be rerun.
+VERDICT_STORE = "../verdicts.db"
+
 # Maximum number of results to print out.
 MAX_NUM_RESULTS = 50
 
+# Number of rows fetched at a time when a student's results are compared with
+# the expected results as they are fetched (for ordered tests).
+STREAM_BATCH_SIZE = 1000
+
 # The number of decimal places to compare results with.
 PRECISION = 2
+
+# Number of rows above which numeric columns are rounded in bulk with NumPy (if
+# it is installed) when comparing results.
+NUMPY_MIN_ROWS = 10000
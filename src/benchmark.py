@@ -0,0 +1,371 @@
+"""
+Module: benchmark
+-----------------
+Benchmarks for parts of the automation tool that do not need a database.
+
+Usage: python benchmark.py canonical --assignment <assignment>
+       python benchmark.py ingest [--lines <lines>] [--problems <problems>]
+                                  [--repeat <repeat>]
+       python benchmark.py subtract [--max-rows <rows>]
+                                    [--legacy-max-rows <rows>]
+"""
+import argparse
+import os
+import time
+from StringIO import StringIO
+from copy import deepcopy
+
+import iotools
+import models
+import sqltools
+from CONFIG import ASSIGNMENT_DIR, STUDENT_DIR
+from iotools import PROBLEM_HEADER
+from stylechecker import StyleChecker
+from verdicts import get_problems
+
+def get_responses(assignment, specs):
+  """
+  Function: get_responses
+  -----------------------
+  Parses the files of every student who submitted the assignment.
+
+  assignment: The assignment.
+  specs: The specs for the assignment.
+  returns: A dict from file name to a list of the students' parsed files.
+  """
+  responses = {}
+  for f in specs["files"]:
+    responses[f] = []
+    for student in iotools.get_students(assignment):
+      path = ASSIGNMENT_DIR + assignment + "/" + STUDENT_DIR + student + "-" + \
+             assignment + "/" + f
+      if os.path.exists(path):
+        with open(path, "r") as student_file:
+          responses[f].append(iotools.parse_file(student_file))
+  return responses
+
+
+def hit_rate(keys):
+  """
+  Function: hit_rate
+  ------------------
+  Gets the fraction of lookups that would be served by an earlier identical key.
+
+  keys: The keys, in the order they are looked up.
+  returns: The hit rate, between 0 and 1.
+  """
+  return 1 - float(len(set(keys))) / len(keys) if len(keys) > 0 else 0.0
+
+
+def bench_canonical(assignment):
+  """
+  Function: bench_canonical
+  -------------------------
+  Compares the keys used to share graded output between responses when the SQL
+  is only normalized (whitespace) and when it is canonicalized. Prints the
+  number of distinct keys and the hit rate for each problem.
+
+  assignment: The assignment to use the student responses of.
+  """
+  specs = iotools.parse_specs(assignment)
+  responses = get_responses(assignment, specs)
+
+  print "%-16s %9s %18s %18s" % ("problem", "responses", "normalized",
+                                  "canonical")
+  (all_normalized, all_canonical) = ([], [])
+  (normalize_time, canonicalize_time) = (0.0, 0.0)
+  for (f, problem) in get_problems(specs):
+    sqls = [parsed[problem["number"]].sql for parsed in responses[f]
+            if problem["number"] in parsed and
+            len(parsed[problem["number"]].sql.strip()) > 0]
+
+    start = time.time()
+    normalized = [sqltools.normalize_sql(sql) for sql in sqls]
+    normalize_time += time.time() - start
+    start = time.time()
+    canonical = [sqltools.canonicalize(sql) for sql in sqls]
+    canonicalize_time += time.time() - start
+
+    # Keys need to be distinct between problems for the overall hit rate.
+    all_normalized += [(f, problem["number"], key) for key in normalized]
+    all_canonical += [(f, problem["number"], key) for key in canonical]
+    print "%-16s %9d %8d (%6.1f%%) %8d (%6.1f%%)" % (
+      f + "|" + problem["number"], len(sqls),
+      len(set(normalized)), 100 * hit_rate(normalized),
+      len(set(canonical)), 100 * hit_rate(canonical))
+
+  print "%-16s %9d %8d (%6.1f%%) %8d (%6.1f%%)" % (
+    "total", len(all_canonical),
+    len(set(all_normalized)), 100 * hit_rate(all_normalized),
+    len(set(all_canonical)), 100 * hit_rate(all_canonical))
+  print "\nTime: %.3fs normalizing, %.3fs canonicalizing." % \
+        (normalize_time, canonicalize_time)
+
+
+def legacy_parse_file(f):
+  """
+  Function: legacy_parse_file
+  ---------------------------
+  The way student files used to be parsed, kept as a baseline: the whole file
+  is preprocessed into a string first, and the responses are built up by
+  concatenating strings.
+
+  f: The file object to parse.
+  returns: The dict of the question number and student's response.
+  """
+
+  # Dictionary containing a mapping from the problem number to the response.
+  responses = {}
+  # The current problem number being parsed.
+  curr = ""
+  # True if in the middle of parsing a block comment.
+  started_block_comment = False
+  # True if in the middle of parsing SQL.
+  started_sql = False
+
+  def add_line(line):
+    """
+    Function: add_line
+    ------------------
+    Adds a line to the comments.
+    """
+    # If these are comments at the top of the file, ignore them.
+    if curr == "":
+      return
+    line = line + "\n"
+    responses[curr].comments += line
+
+  inline_comment = ""
+  # Preprocess the file for DELIMITER statements.
+  f = sqltools.preprocess_sql(f)
+  for line in f.split("\n"):
+    # Remove tabs.
+    line = line.replace("\t", "    ")
+
+    # If in the middle of a block comment.
+    if started_block_comment:
+      # See if they are now ending the block comment.
+      if line.strip().endswith("*/"):
+        started_block_comment = False
+        line = line.replace(" */", "").replace("*/", "").strip()
+      # Strip out leading *'s if they have any.
+      if line.strip().startswith("*"):
+        line = (line[line.find("*") + 1:]).strip()
+      add_line(line)
+
+    # If this is a blank line, just skip it.
+    elif len(line.strip()) == 0:
+      continue
+
+    # Indicator denoting the start of an response.
+    elif (line.strip().lower().startswith(PROBLEM_HEADER) and
+          "]" in line and line.index("]") > line.lower().index(PROBLEM_HEADER)):
+      started_sql = False
+      curr = line[line.lower().index(PROBLEM_HEADER) + len(PROBLEM_HEADER):
+                  line.index("]")]
+      curr = curr.strip()
+      # This is a new problem, so create an empty response to with no comments.
+      responses[curr] = models.Response()
+
+    # Lines with comments of the form "--". Only add this to the comments if it
+    # is before the SQL starts appearing.
+    elif not started_sql and line.strip().startswith("--"):
+      add_line(line.replace("-- ", "").replace("--", ""))
+
+    # Block comments of the form /* */.
+    elif line.strip().startswith("/*"):
+      started_block_comment = True
+      line = line.replace("/* ", "").replace("/*", "").strip()
+       # See if they are now ending the block comment.
+      if line.strip().endswith("*/"):
+        started_block_comment = False
+        line = line.replace(" */", "").replace("*/", "").strip()
+      add_line(line)
+
+    # Inline comment.
+    elif started_sql and line.strip().startswith("--"):
+      inline_comment += line + "\n"
+
+    # SQL code.
+    elif started_sql:
+      responses[curr].sql += inline_comment
+      inline_comment = ""
+      responses[curr].sql += line + "\n"
+
+    # Continuation of a response from a previous line, or the start of a SQL
+    # statement. This could also contain comments.
+    elif curr != "":
+      started_sql = True
+      responses[curr].sql += line + "\n"
+      inline_comment = ""
+
+  return responses
+
+
+def make_submission(num_lines, num_problems):
+  """
+  Function: make_submission
+  -------------------------
+  Makes a large synthetic submission, with a mix of comments, SQL and
+  DELIMITER statements spread across a few problems.
+
+  num_lines: The (approximate) number of lines in the submission.
+  num_problems: The number of problems in the submission.
+  returns: The contents of the submission.
+  """
+  lines = []
+  for problem in range(1, num_problems + 1):
+    lines += ["-- [Problem %d]" % problem,
+              "-- Find the accounts with the largest balance in each branch.",
+              "/* The balances are compared within each branch,",
+              " * and ties are all kept. */"]
+    for i in range(num_lines / num_problems / 4):
+      lines += ["SELECT branch_name, account_number, balance",
+                "  -- Only the largest balance.",
+                "FROM account NATURAL JOIN depositor",
+                "WHERE balance > %d AND\tbranch_name = 'Downtown';" % i]
+    lines += ["DELIMITER !",
+              "CREATE FUNCTION f%d() RETURNS INTEGER" % problem,
+              "BEGIN",
+              "  RETURN 1;",
+              "END !",
+              "DELIMITER ;",
+              ""]
+  return "\n".join(lines) + "\n"
+
+
+def bench_ingest(num_lines, num_problems, repeat):
+  """
+  Function: bench_ingest
+  ----------------------
+  Compares style checking and parsing a large submission in two passes (the
+  way it used to be done) against doing both in a single streaming pass.
+
+  num_lines: The number of lines in the submission.
+  num_problems: The number of problems in the submission.
+  repeat: The number of times to ingest the submission each way.
+  """
+  contents = make_submission(num_lines, num_problems)
+
+  start = time.time()
+  for _ in range(repeat):
+    f = StringIO(contents)
+    errors = StyleChecker.check(f)
+    f.seek(0)
+    responses = legacy_parse_file(f)
+  two_pass_time = (time.time() - start) / repeat
+
+  start = time.time()
+  for _ in range(repeat):
+    (ingest_errors, ingest_responses) = iotools.ingest(StringIO(contents))
+  ingest_time = (time.time() - start) / repeat
+
+  same = (sorted(errors) == sorted(ingest_errors) and
+          sorted(responses.keys()) == sorted(ingest_responses.keys()) and
+          all(responses[num].sql == ingest_responses[num].sql and
+              responses[num].comments == ingest_responses[num].comments
+              for num in responses))
+  print "Submission: %d lines, %d problems." % \
+        (contents.count("\n"), len(responses))
+  print "%-10s %10.4fs" % ("two-pass", two_pass_time)
+  print "%-10s %10.4fs (%.1fx)" % ("ingest", ingest_time,
+                                    two_pass_time / max(ingest_time, 1e-9))
+  print "Same output: %s" % same
+
+
+def legacy_subtract(result, other):
+  """
+  Function: legacy_subtract
+  -------------------------
+  The way results used to be subtracted, kept as a baseline: the result is
+  deep copied and each row is looked for in the other result's list of rows.
+  """
+  new_result = deepcopy(result)
+  new_result.results = [row for row in new_result.results
+                        if row not in other.results]
+  return new_result
+
+
+def make_table(num_rows):
+  """
+  Function: make_table
+  --------------------
+  Makes the result of selecting everything from a synthetic table.
+
+  num_rows: The number of rows in the table.
+  returns: The result.
+  """
+  result = models.Result()
+  result.col_names = ["account_number", "branch_name", "balance"]
+  result.schema = [(name, None, None, None, None, None, 1, 0)
+                   for name in result.col_names]
+  result.col_types = [str, str, float]
+  result.results = [("A-%07d" % i, "Branch %d" % (i % 50), i * 1.25)
+                    for i in range(num_rows)]
+  return result
+
+
+def bench_subtract(max_rows, legacy_max_rows):
+  """
+  Function: bench_subtract
+  ------------------------
+  Times subtracting a table's contents before a change from its contents after
+  the change (as the INSERT, UPDATE and DELETE problem types do for a failing
+  test), for tables from 1k rows up to the given size. The old way of
+  subtracting is only timed up to a smaller size since it is quadratic.
+
+  max_rows: The largest table to time.
+  legacy_max_rows: The largest table to time the old way of subtracting on.
+  """
+  print "%10s %12s %12s" % ("rows", "subtract", "legacy")
+  num_rows = 1000
+  while num_rows <= max_rows:
+    before = make_table(num_rows)
+    after = make_table(num_rows)
+    after.results = after.results[10:] + [("B-%07d" % i, "Branch 0", 0.0)
+                                          for i in range(10)]
+
+    start = time.time()
+    added = after.subtract(before)
+    subtract_time = time.time() - start
+
+    legacy = "-"
+    if num_rows <= legacy_max_rows:
+      start = time.time()
+      legacy_added = legacy_subtract(after, before)
+      legacy = "%11.3fs" % (time.time() - start)
+      assert legacy_added.results == added.results
+    print "%10d %11.3fs %12s" % (num_rows, subtract_time, legacy)
+    num_rows *= 10
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  subparsers = parser.add_subparsers(dest="benchmark")
+  canonical_parser = subparsers.add_parser(
+    "canonical", help="Hit rate of normalized vs. canonical SQL keys")
+  canonical_parser.add_argument("--assignment", required=True,
+                                help="Name of the assignment (cs121hw#)")
+  ingest_parser = subparsers.add_parser(
+    "ingest", help="Two-pass vs. single-pass ingestion of a large submission")
+  ingest_parser.add_argument("--lines", type=int, default=100000,
+                             help="Number of lines in the submission")
+  ingest_parser.add_argument("--problems", type=int, default=10,
+                             help="Number of problems in the submission")
+  ingest_parser.add_argument("--repeat", type=int, default=3,
+                             help="Number of times to ingest the submission")
+  subtract_parser = subparsers.add_parser(
+    "subtract", help="Scaling of subtracting large results")
+  subtract_parser.add_argument("--max-rows", type=int, default=1000000,
+                               help="Largest number of rows to time")
+  subtract_parser.add_argument("--legacy-max-rows", type=int, default=10000,
+                               help="Largest number of rows to time the old "
+                                    "way of subtracting on")
+  args = parser.parse_args()
+
+  if args.benchmark == "canonical":
+    bench_canonical(args.assignment)
+  elif args.benchmark == "ingest":
+    bench_ingest(args.lines, args.problems, args.repeat)
+  elif args.benchmark == "subtract":
+    bench_subtract(args.max_rows, args.legacy_max_rows)
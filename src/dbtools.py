@@ -12,9 +12,10 @@ import mysql.connector.errors
 
 from cache import Cache
 from CONFIG import *
-from errors import DatabaseError, TimeoutError
+from errors import DatabaseError, ResultTooLargeError, TimeoutError
 from iotools import (
   err,
+  fingerprint,
   log,
   prettyprint
 )
@@ -150,6 +151,45 @@ class DBTools:
     return self
 
 
+  def get_fingerprint(self):
+    """
+    Function: get_fingerprint
+    -------------------------
+    Gets a fingerprint of the contents of the database. This includes the
+    checksum of every table as well as the definitions of all views, functions,
+    procedures, and triggers. Queries run against two databases with the same
+    fingerprint give the same results.
+
+    returns: The fingerprint as a hex string.
+    """
+    tables = self.execute_sql(
+      "SELECT table_name FROM information_schema.tables "
+      "WHERE table_schema=DATABASE() AND table_type='BASE TABLE' "
+      "ORDER BY table_name"
+    ).results
+    checksums = []
+    if len(tables) > 0:
+      checksums = self.execute_sql(
+        "CHECKSUM TABLE " + ", ".join(["`%s`" % t for (t,) in tables])
+      ).results
+
+    views = self.execute_sql(
+      "SELECT table_name, view_definition FROM information_schema.views "
+      "WHERE table_schema=DATABASE() ORDER BY table_name"
+    ).results
+    routines = self.execute_sql(
+      "SELECT routine_name, routine_type, routine_definition FROM "
+      "information_schema.routines WHERE routine_schema=DATABASE() "
+      "ORDER BY routine_name, routine_type"
+    ).results
+    triggers = self.execute_sql(
+      "SELECT trigger_name, event_object_table, action_statement FROM "
+      "information_schema.triggers WHERE trigger_schema=DATABASE() "
+      "ORDER BY trigger_name"
+    ).results
+    return fingerprint(checksums, views, routines, triggers)
+
+
   def get_state(self):
     """
     Function: get_state
@@ -376,7 +416,8 @@ class DBTools:
       else:
           raise
 
-  def execute_sql(self, sql, setup=None, teardown=None, cached=False):
+  def execute_sql(self, sql, setup=None, teardown=None, cached=False,
+                  max_rows=None):
     """
     Function: execute_sql
     ---------------------
@@ -388,6 +429,8 @@ class DBTools:
     teardown: The teardown query to run after executing the actual query.
     cached: Whether or not the result should be pulled from the cache. True if
             so, False otherwise.
+    max_rows: The most rows a SELECT statement in the query may return (see
+              limit_results), or None to not limit them.
 
     returns: A Result object containing the result.
     """
@@ -401,10 +444,14 @@ class DBTools:
       #   print("-" * 78)
       #   print("Running SQL statement:\n%s\n(use cached result = %s)" % (sql, str(cached)))
 
+      if max_rows is not None:
+        self.limit_results(max_rows)
       result = self.run_multi(sql, cached)
 
     # Run the query teardown.
     finally:
+      if max_rows is not None:
+        self.limit_results(None)
       if teardown is not None:
         # if VERBOSE:
         #   print("-" * 78)
@@ -414,28 +461,71 @@ class DBTools:
     return result
 
 
-  def get_column_names(self):
+  def explain(self, sql, setup=None, teardown=None):
+    """
+    Function: explain
+    -----------------
+    Estimates how many rows a statement examines with EXPLAIN, without running
+    it. The tables joined in each SELECT are examined once for every
+    combination of rows before them, so the estimates of their rows are
+    multiplied, and the estimates of the separate SELECTs are added up.
+
+    sql: The statement (a SELECT, INSERT, UPDATE or DELETE).
+    setup: The setup query to run before explaining the statement.
+    teardown: The teardown query to run after explaining the statement.
+    returns: A tuple of the form (estimated rows, pretty-printed EXPLAIN
+             output), or None if the statement could not be explained.
+    """
+    statements = [s for s in split(sql) if len(s.strip().rstrip(";")) > 0]
+    if len(statements) != 1:
+      return None
+    try:
+      plan = self.execute_sql("EXPLAIN " + statements[0].strip().rstrip(";"),
+                              setup, teardown)
+    except TimeoutError:
+      raise
+    except DatabaseError:
+      return None
+    if "id" not in plan.col_names or "rows" not in plan.col_names:
+      return None
+
+    select_id = plan.col_names.index("id")
+    rows = plan.col_names.index("rows")
+    estimates = {}
+    for row in plan.results:
+      estimates[row[select_id]] = \
+        estimates.get(row[select_id], 1) * max(int(row[rows] or 1), 1)
+    return (sum(estimates.values()), plan.output)
+
+
+  def get_column_names(self, cursor=None):
     """
     Function: get_column_names
     --------------------------
     Gets the column names of the result.
+
+    cursor: The cursor with the result (the main cursor if not given).
     """
-    if self.cursor.description is None:
+    cursor = cursor or self.cursor
+    if cursor.description is None:
       return []
-    return [col[0] for col in self.cursor.description]
+    return [col[0] for col in cursor.description]
 
 
-  def get_column_types(self):
+  def get_column_types(self, cursor=None):
     """
     Function: get_column_types
     --------------------------
     Gets the column types of the result.
+
+    cursor: The cursor with the result (the main cursor if not given).
     """
-    if self.cursor.description is None:
+    cursor = cursor or self.cursor
+    if cursor.description is None:
       return []
     return [
       (float if col[1] in FLOAT_FIELD_TYPES else str) \
-      for col in self.cursor.description
+      for col in cursor.description
     ]
 
 
@@ -461,6 +551,75 @@ class DBTools:
     return result
 
 
+  def get_result_fingerprint(self, sql, setup=None, teardown=None,
+                             max_rows=None):
+    """
+    Function: get_result_fingerprint
+    --------------------------------
+    Gets a fingerprint of the result of a SELECT statement without fetching its
+    rows. The database hashes every row and returns the number of rows and the
+    sum of the hashes, so results with the same rows (in any order) have the
+    same fingerprint. Values are hashed exactly as the database returns them,
+    so results that are only equal once rounded have different fingerprints.
+
+    sql: The SELECT statement.
+    setup: The setup query to run before computing the fingerprint.
+    teardown: The teardown query to run after computing the fingerprint.
+    max_rows: The most rows the statement may return (see limit_results), or
+              None to not limit them. Only the guard against statements that
+              examine too many rows matters here, since the rows are counted
+              in the database.
+    returns: A tuple of the form (column names, fingerprint), where the
+             fingerprint is a tuple of the form (number of rows, hash sum, hash
+             sum). None if the fingerprint could not be computed (for example,
+             if the statement has duplicate column names).
+    """
+    statements = [s for s in split(sql) if len(s.strip().rstrip(";")) > 0]
+    if len(statements) != 1:
+      return None
+    sql = statements[0].strip().rstrip(";")
+
+    if setup is not None:
+      self.run_multi(setup)
+    try:
+      if max_rows is not None:
+        self.limit_results(max_rows)
+
+      # Find the column names of the result without running the whole query.
+      try:
+        self.run_multi("SELECT * FROM (%s) AS result LIMIT 0" % sql)
+      except (TimeoutError, ResultTooLargeError):
+        raise
+      except DatabaseError:
+        return None
+      col_names = self.get_column_names()
+      if len(col_names) == 0:
+        return None
+
+      # Hash each row of the result in the database, and add up the two halves
+      # of the hashes so the sums cannot overflow.
+      quoted = ["QUOTE(`%s`)" % col.replace("`", "``") for col in col_names]
+      row_hash = "MD5(CONCAT_WS(',', %s))" % ", ".join(quoted)
+      try:
+        (rows, hi, lo) = self.run_multi(
+          "SELECT COUNT(*), "
+          "SUM(CAST(CONV(SUBSTRING(h, 1, 16), 16, 10) AS UNSIGNED)), "
+          "SUM(CAST(CONV(SUBSTRING(h, 17, 16), 16, 10) AS UNSIGNED)) "
+          "FROM (SELECT %s AS h FROM (%s) AS result) AS hashes" %
+          (row_hash, sql)
+        ).results[0]
+      except (TimeoutError, ResultTooLargeError):
+        raise
+      except DatabaseError:
+        return None
+    finally:
+      if max_rows is not None:
+        self.limit_results(None)
+      if teardown is not None:
+        self.run_multi(teardown)
+    return (col_names, (int(rows), str(hi), str(lo)))
+
+
   def get_schema(self):
     """
     Function: get_schema
@@ -471,6 +630,101 @@ class DBTools:
     return self.cursor.description
 
 
+  def limit_results(self, max_rows):
+    """
+    Function: limit_results
+    -----------------------
+    Guards the session against queries that return or examine too many rows.
+    Until the limits are lifted, SELECT statements return at most max_rows rows
+    (the rest are never sent), and SELECT statements that MySQL estimates will
+    examine more than MAX_JOIN_SIZE row combinations fail with a
+    ResultTooLargeError.
+
+    max_rows: The most rows a SELECT statement may return, or None to lift the
+              limits.
+    """
+    if max_rows is None:
+      self.run_multi("SET SESSION sql_select_limit = DEFAULT, "
+                     "SESSION max_join_size = DEFAULT")
+    else:
+      limits = "SET SESSION sql_select_limit = %d" % max_rows
+      if MAX_JOIN_SIZE is not None:
+        limits += ", SESSION max_join_size = %d" % MAX_JOIN_SIZE
+      self.run_multi(limits)
+
+
+  def stream_sql(self, sql, result, setup=None, teardown=None,
+                 batch_size=STREAM_BATCH_SIZE, max_rows=None):
+    """
+    Function: stream_sql
+    --------------------
+    Runs one or more queries like execute_sql, but fetches the rows of the last
+    one a batch at a time through an unbuffered cursor, so the caller can stop
+    fetching them whenever it wants. Once the caller stops, the rows that were
+    not fetched are thrown away by the connector and the teardown is run.
+
+    sql: The SQL query to run.
+    result: The Result to store the schema, column names and column types of
+            the last query in, which are set before the first batch.
+    setup: The setup query to run before executing the actual query.
+    teardown: The teardown query to run after executing the actual query.
+    batch_size: The number of rows to fetch at a time.
+    max_rows: The most rows a SELECT statement in the query may return (see
+              limit_results), or None to not limit them.
+    returns: A generator of lists of rows.
+    """
+    statements = [s.rstrip().rstrip(";") for s in split(sql)]
+    statements = [s for s in statements if len(s.strip()) > 0]
+    if setup is not None:
+      self.run_multi(setup)
+
+    cursor = None
+    try:
+      if max_rows is not None:
+        self.limit_results(max_rows)
+      for statement in statements[:-1]:
+        self.run_multi(statement)
+      if len(statements) == 0:
+        return
+
+      try:
+        self.clear_cursor()
+        cursor = self.db.cursor()
+        cursor.execute(statements[-1])
+        result.schema = cursor.description
+        result.col_names = self.get_column_names(cursor)
+        result.col_types = self.get_column_types(cursor)
+        while cursor.description is not None:
+          rows = cursor.fetchmany(batch_size)
+          if len(rows) == 0:
+            break
+          yield rows
+
+      # If the query times out.
+      except mysql.connector.errors.OperationalError as e:
+        raise TimeoutError(e)
+
+      # If something is wrong with their query.
+      except mysql.connector.errors.Error as e:
+        if e.errno == ResultTooLargeError.ERRNO:
+          raise ResultTooLargeError(e)
+        raise DatabaseError(e)
+
+    # Throw away the rest of the rows and run the query teardown.
+    finally:
+      if cursor is not None:
+        try:
+          if self.db.unread_result:
+            self.db.consume_results()
+          cursor.close()
+        except mysql.connector.errors.Error as e:
+          err("Could not close the cursor: %s" % str(e))
+      if max_rows is not None:
+        self.limit_results(None)
+      if teardown is not None:
+        self.run_multi(teardown)
+
+
   def run_multi(self, queries, cached=False):
     """
     Function: run_multi
@@ -495,7 +749,7 @@ class DBTools:
       if len(sql) == 0:
         continue
 
-      query_results = Cache.get(sql)
+      query_results = Cache.get(sql) if cached else None
 
       # Results are not to be cached or are not in the cache and needs to
       # be cached. Run the query.
@@ -519,6 +773,8 @@ class DBTools:
         except mysql.connector.errors.ProgrammingError as e:
           if 'already exists' in str(e):
               log("[warning: %s]" % str(e))
+          elif e.errno == ResultTooLargeError.ERRNO:
+              raise ResultTooLargeError(e)
           else:
               raise DatabaseError(e)
 
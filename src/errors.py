@@ -40,6 +40,23 @@ class FileNotFoundError(Error):
   def __repr__(self):
     return "FileNotFoundError: File %s could not be found." % self.filename
 
+
+class ArchiveError(Error):
+  """
+  Class: ArchiveError
+  -------------------
+  Occurs when the archive a student submitted cannot be read, so none of their
+  files can be graded.
+  """
+  def __init__(self, archive, reason):
+    super(ArchiveError, self).__init__()
+    self.archive = archive
+    self.reason = reason
+
+  def __repr__(self):
+    return "ArchiveError: Archive %s could not be read (%s)." % \
+           (self.archive, self.reason)
+
 # ------------------------------ Grading Errors ----------------------------- #
 
 class StyleError(Error):
@@ -199,14 +216,14 @@ class DatabaseError(Error):
   - http://dev.mysql.com/doc/refman/5.7/en/error-messages-server.html
   - http://dev.mysql.com/doc/refman/5.7/en/error-messages-client.html
   """
-  def __init__(self, error):
+  def __init__(self, error=None):
     super(DatabaseError, self).__init__()
 
-    # The MySQL error number.
-    self.errno = error.errno
+    # The MySQL error number (0 if the error did not come from MySQL).
+    self.errno = error.errno if error is not None else 0
 
     # The message to print.
-    self.msg = error.msg
+    self.msg = error.msg if error is not None else None
 
 
   def __repr__(self):
@@ -280,3 +297,48 @@ class TimeoutError(DatabaseError):
 
   def __repr__(self):
     return "TimeoutError: Query timed out."
+
+
+
+class QueryCostError(DatabaseError):
+  """
+  Class: QueryCostError
+  ---------------------
+  Occurs when a query is not run because EXPLAIN estimates it would examine far
+  more rows than the solution (see EXPLAIN_COST_MULTIPLE in the CONFIG file).
+  The test fails as if the query timed out.
+  """
+  def __init__(self, estimate, solution_estimate):
+    # There is no MySQL error for this.
+    super(QueryCostError, self).__init__()
+    self.msg = "Query would examine too many rows."
+
+    # The estimated number of rows examined by the query and the solution.
+    self.estimate = estimate
+    self.solution_estimate = solution_estimate
+
+
+  def __repr__(self):
+    return ("QueryCostError: Query was not run, since MySQL estimates it " +
+            "examines %d rows (the solution examines %d).") % \
+           (self.estimate, self.solution_estimate)
+
+
+
+class ResultTooLargeError(DatabaseError):
+  """
+  Class: ResultTooLargeError
+  --------------------------
+  Occurs when MySQL refuses to run a query because it would examine more rows
+  than the session allows (see MAX_JOIN_SIZE in the CONFIG file).
+  """
+  # The MySQL error number for a SELECT that would examine too many rows.
+  ERRNO = 1104
+
+  def __init__(self, error):
+    super(ResultTooLargeError, self).__init__(error)
+
+
+  def __repr__(self):
+    return "ResultTooLargeError: Result too large, query would examine too " + \
+           "many rows."
@@ -21,6 +21,10 @@ from CONFIG import (
 )
 from problemtype import PROBLEM_TYPES
 
+# The contents of the stylesheet, which is put inline when hiding solutions. It
+# is read once, the first time it is needed.
+_CSS = None
+
 def create_path(assignment):
   """
   Function: create_path
@@ -30,17 +34,20 @@ def create_path(assignment):
 
   assignment: The assignment that is currently being graded.
   """
-  # Copy necessary stylesheets and create results folder if it doesn't exist.
-  path = ASSIGNMENT_DIR + assignment + "/"
-  if not os.path.exists(path + RESULT_DIR):
-    os.mkdir(path + RESULT_DIR)
-    os.mkdir(path + RESULT_DIR + FILE_DIR)
-    os.mkdir(path + RESULT_DIR + STUDENT_OUTPUT_DIR)
-    os.mkdir(path + RESULT_DIR + STYLE_DIR_BASE)
+  # Copy necessary stylesheets and create results folders if they don't exist.
+  # The results folder itself may already exist without them, since the result
+  # store and journal are kept there too.
+  path = ASSIGNMENT_DIR + assignment + "/" + RESULT_DIR
+  for directory in [FILE_DIR, STUDENT_OUTPUT_DIR]:
+    if not os.path.exists(path + directory):
+      os.makedirs(path + directory)
+
+  if not os.path.exists(path + STYLE_DIR_BASE):
+    os.makedirs(path + STYLE_DIR_BASE)
 
     # Copy over stylesheets and Javascript files.
     for f in os.listdir(STYLE_DIR):
-      shutil.copy(STYLE_DIR + f, path + RESULT_DIR + STYLE_DIR_BASE + f)
+      shutil.copy(STYLE_DIR + f, path + STYLE_DIR_BASE + f)
 
 
 def escape(text):
@@ -58,6 +65,19 @@ def escape(text):
     return text
 
 
+def get_css():
+  """
+  Function: get_css
+  -----------------
+  Gets the contents of the stylesheet.
+  """
+  global _CSS
+  if _CSS is None:
+    with open(STYLE_DIR + "css.css", "r") as css:
+      _CSS = css.read()
+  return _CSS
+
+
 def generate_student_list(specs):
   """
   Function: generate_student_list
@@ -155,7 +175,7 @@ def format_output(output, specs, studentlst=None):
   return o.getvalue()
 
 
-def format_raw_file(fname, student, assignment):
+def format_raw_file(fname, student, assignment, contents=None):
   """
   Function: format_raw_file
   -------------------------
@@ -164,13 +184,16 @@ def format_raw_file(fname, student, assignment):
 
   fname: The raw filename.
   specs: The specs for the assignment.
+  contents: The contents of the file, if they have already been read.
   """
   try:
     out = open(ASSIGNMENT_DIR + assignment + "/" + RESULT_DIR + FILE_DIR +
                student + "-" + fname + ".raw.html", 'w')
-    infile = open(ASSIGNMENT_DIR + assignment + "/" + STUDENT_DIR +
-                  student + "-" + assignment + "/" + fname, 'r')
-    contents = infile.read()
+    if contents is None:
+      infile = open(ASSIGNMENT_DIR + assignment + "/" + STUDENT_DIR +
+                    student + "-" + assignment + "/" + fname, 'r')
+      contents = infile.read()
+      infile.close()
 
     # HTML-ize the file.
     contents = contents.replace("&", "&amp;")
@@ -184,7 +207,7 @@ def format_raw_file(fname, student, assignment):
     return
 
 
-def format_student(student, output, specs, hide_solutions):
+def format_student(student, output, specs, hide_solutions, raw_files=None):
   """
   Function: format_student
   ------------------------
@@ -195,6 +218,8 @@ def format_student(student, output, specs, hide_solutions):
   output: The student's JSON output.
   specs: The specs for the assignment.
   hide_solutions: Whether or not to hide solution output.
+  raw_files: The contents of the student's files keyed by filename, if they
+             have already been read.
   """
 
   # Create the necessary directories if needed.
@@ -204,15 +229,15 @@ def format_student(student, output, specs, hide_solutions):
   if hide_solutions:
     o = StringIO()
     o.write("<style type='text/css'>\n")
-    css = open(STYLE_DIR + "css.css", 'r')
-    o.write(css.read())
+    o.write(get_css())
     o.write("</style>")
 
   # Create output per student, per file. Files are named <student>-<file>.html.
   for (fname, f) in output["files"].iteritems():
     # Generate HTML versions of raw files (so it can be displayed on IE and
     # other browsers).
-    format_raw_file(fname, student, specs["assignment"])
+    format_raw_file(fname, student, specs["assignment"],
+                    (raw_files or {}).get(fname))
 
     if not hide_solutions:
       o = StringIO()
@@ -1,14 +1,18 @@
 from __future__ import print_function
 
+import time
+from copy import deepcopy
+
 from errors import (
   add,
   DatabaseError,
   DependencyError
 )
-from iotools import log
+from iotools import fingerprint, log
 from problemtype import PROBLEM_TYPES
+from verdicts import problem_key
 
-from CONFIG import VERBOSE
+from CONFIG import CONNECTION_TIMEOUT, VERBOSE
 
 VERBOSE_LEVEL = 0
 
@@ -20,7 +24,7 @@ class Grader:
   of tests on that problem.
   """
 
-  def __init__(self, assignment, specs, db):
+  def __init__(self, assignment, specs, db, verdicts=None, timings=None):
     # Which assignment this is for
     self.assignment = assignment
 
@@ -30,6 +34,126 @@ class Grader:
     # The database tool object used to interact with the database.
     self.db = db
 
+    # The persistent store of graded output, if it is being used.
+    self.verdicts = verdicts
+
+    # The history of how long the solution queries take, if it is being kept.
+    self.timings = timings
+
+    # The fingerprint of the database before grading, used to look up entries
+    # in the persistent store.
+    self.db_fingerprint = db.get_fingerprint() if verdicts else None
+
+    # Hashes of the compiled specs for each problem, keyed by (file, number).
+    self.problem_keys = {}
+
+    # Graded output of responses that can be shared between students. The key
+    # is a hash of the problem specs and the canonical SQL and the value is the
+    # graded output of the first student with that response.
+    self.graded_responses = {}
+
+    # The number of test executions saved by sharing graded output.
+    self.reused_tests = 0
+
+
+  def get_problem_key(self, filename, problem):
+    """
+    Function: get_problem_key
+    -------------------------
+    Gets the hash of the compiled specs for a problem.
+
+    filename: The file the problem is in.
+    problem: The specs for the problem.
+    returns: The hash as a hex string.
+    """
+    if (filename, problem["number"]) not in self.problem_keys:
+      self.problem_keys[(filename, problem["number"])] = \
+        problem_key(self.specs, filename, problem)
+    return self.problem_keys[(filename, problem["number"])]
+
+
+  def get_reuse_key(self, filename, problem, grade_fn):
+    """
+    Function: get_reuse_key
+    -----------------------
+    Gets the key used to share graded output between identical responses. Only
+    responses to read-only problems without dependencies or setup queries can be
+    shared, since otherwise the result depends on what else has been run. The
+    key includes the canonical form of the SQL that is actually run, so that
+    responses which only differ in spacing, comments, case, aliases or the order
+    of AND conditions are graded once.
+
+    filename: The file the problem is in.
+    problem: The specs for the problem.
+    grade_fn: The problem type handler for the response.
+    returns: The key, or None if the graded output cannot be shared.
+    """
+    if problem.get("dependencies") or problem.get("setup"):
+      return None
+    reuse_key = grade_fn.get_reuse_key()
+    if reuse_key is None:
+      return None
+    return fingerprint(self.get_problem_key(filename, problem), reuse_key)
+
+
+  def get_shared(self, key):
+    """
+    Function: get_shared
+    --------------------
+    Gets the shared graded output for a response, either from a previous
+    student in this run or from the persistent store.
+
+    key: The key for the shared graded output.
+    returns: The shared graded output, None if there is none.
+    """
+    if key is None:
+      return None
+    if key not in self.graded_responses and self.verdicts is not None:
+      shared = self.verdicts.get(fingerprint(key, self.db_fingerprint))
+      if shared is not None:
+        self.graded_responses[key] = shared
+    return self.graded_responses.get(key)
+
+
+  def reuse(self, shared, graded_problem):
+    """
+    Function: reuse
+    ---------------
+    Copies the shared graded output of an identical response into this graded
+    problem.
+
+    shared: The shared graded output.
+    graded_problem: The graded problem output to fill in.
+    returns: The number of points received for this problem.
+    """
+    shared = deepcopy(shared)
+    graded_problem["tests"] = shared["tests"]
+    graded_problem["errors"] += shared["errors"]
+    graded_problem["got_points"] = shared["got_points"]
+    self.reused_tests += len(shared["tests"])
+    return shared["got_points"]
+
+
+  def share(self, key, filename, problem, shared):
+    """
+    Function: share
+    ---------------
+    Shares the graded output of a response with later identical responses, and
+    saves it in the persistent store if it is being used.
+
+    key: The key for the shared graded output.
+    filename: The file the problem is in.
+    problem: The specs for the problem.
+    shared: The graded output to share.
+    """
+    self.graded_responses[key] = deepcopy(shared)
+    if self.verdicts is not None:
+      self.verdicts.put(fingerprint(key, self.db_fingerprint),
+                        self.assignment,
+                        filename + "|" + problem["number"],
+                        self.get_problem_key(filename, problem),
+                        shared)
+
 
   def run_dependencies(self, problem, response, processed_files):
     """
@@ -80,7 +204,7 @@ class Grader:
       raise
 
 
-  def grade(self, response, output):
+  def grade(self, response, output, only=None):
     """
     Function: grade
     ---------------
@@ -88,9 +212,15 @@ class Grader:
 
     response: The student's response.
     output: The graded output.
+    only: If given, the problems to regrade, as a set of <file>|<problem
+          number>. The output must then be the student's graded output from a
+          previous run, and the graded output of the other problems is kept.
 
     returns: The number of points received for this problem.
     """
+    # Start each student at the default timeout (see ProblemType.grade).
+    self.db.get_db_connection(CONNECTION_TIMEOUT)
+
     # Grade the files (that exist) for this student.
     total_points = 0
     processed_files = []
@@ -106,6 +236,15 @@ class Grader:
       (responses, graded_file) = (response[f], output["files"][f])
       got_points = 0
 
+      # Keep the graded output of problems that do not need to be regraded.
+      stored = {}
+      if only is not None:
+        stored = dict([(graded_problem["num"], graded_problem)
+                       for graded_problem in graded_file["problems"]])
+        graded_file["problems"] = []
+      regrade_file = only is None or \
+                     any([name.startswith(f + "|") for name in only])
+
       if VERBOSE_LEVEL > 0:
         print("Submission %s contains responses for problems:  %s" %
               (f, ",".join([num for num in responses])))
@@ -117,8 +256,9 @@ class Grader:
           err("Spec for file %s has no \"tests\"!" % f, true)
         problems = filespec["tests"]
 
-        # If there is any setup for this file, do it.
-        if "setup" in filespec:
+        # If there is any setup for this file, do it. It is not needed if none
+        # of the problems in the file are being regraded.
+        if "setup" in filespec and regrade_file:
           for item in filespec["setup"]:
             if item["type"] == "source":
               if VERBOSE:
@@ -143,6 +283,11 @@ class Grader:
       for problem in problems:
         # Add this graded problem to the list in the graded file.
         num = problem["number"]
+        if only is not None and f + "|" + num not in only and num in stored:
+          graded_file["problems"].append(stored[num])
+          got_points += stored[num]["got_points"]
+          continue
+
         graded_problem = {
           "num": num,
           "tests": [],
@@ -150,6 +295,7 @@ class Grader:
           "got_points": 0
         }
         graded_file["problems"].append(graded_problem)
+        start = time.time()
 
         try:
           # Check to see if the response is actually blank. (They included the
@@ -160,14 +306,33 @@ class Grader:
           # Call the grade function on the specific class corresponding to this
           # problem type.
           grade_fn = PROBLEM_TYPES[problem["type"]]
-          grade_fn = grade_fn(self.assignment, self.db, problem, responses[num], graded_problem)
+          grade_fn = grade_fn(self.assignment, self.db, problem, responses[num], graded_problem,
+                              self.timings)
           grade_fn.preprocess()
 
+          # If another student had the same response, reuse their graded output
+          # instead of running the tests again.
+          key = self.get_reuse_key(f, problem, grade_fn)
+          shared = self.get_shared(key)
+          if shared is not None:
+            got_points += self.reuse(shared, graded_problem)
+            continue
+          num_errors = len(graded_problem["errors"])
+
           # Run dependent query.
           self.run_dependencies(problem, response, processed_files)
 
           got_points += grade_fn.grade()
 
+          # Share the graded output with identical responses. Don't share it
+          # if a query timed out, since that might be due to the server load.
+          if key is not None and not grade_fn.timed_out:
+            self.share(key, f, problem, {
+              "tests": graded_problem["tests"],
+              "errors": graded_problem["errors"][num_errors:],
+              "got_points": graded_problem["got_points"]
+            })
+
         except DependencyError as e:
           add(graded_problem["errors"], e)
 
@@ -181,12 +346,18 @@ class Grader:
         # Run teardown queries.
         finally:
           self.run_teardown(problem)
+          graded_problem["time"] = time.time() - start
           log(".")
 
-      processed_files.append(f)
+      # When only regrading some problems, the others in the file have not been
+      # run, so their dependencies still need to be run.
+      if only is None:
+        processed_files.append(f)
 
       # Compute total points for this file.
       graded_file["got_points"] = got_points
       total_points += got_points
 
+    if self.verdicts is not None:
+      self.verdicts.commit()
     return total_points
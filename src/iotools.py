@@ -4,6 +4,7 @@ Module: iotools
 Functions involving input and output into the system, as well as file-related
 functions.
 """
+import hashlib
 import json
 import os
 import sys
@@ -25,6 +26,7 @@ from CONFIG import (
   VERBOSE
 )
 from models import Response
+from stylechecker import StyleChecker
 
 PROBLEM_HEADER = "-- [Problem ".lower()
 
@@ -57,8 +59,177 @@ def log(string):
     print string,
     sys.stdout.flush()
 
+# ------------------------------ Parsing Files ------------------------------ #
+
+class ResponseParser:
+  """
+  Class: ResponseParser
+  ---------------------
+  Parses a student's file one line at a time into their responses. Handles
+  DELIMITER statements as it goes, and collects the comments and SQL for each
+  response in lists that are only joined at the end.
+  """
+
+  def __init__(self):
+    # The comments and SQL lines for each problem number, in the order the
+    # problems appear.
+    self.comments = {}
+    self.sql = {}
+    self.problems = []
+
+    # The current problem number being parsed.
+    self.curr = ""
+
+    # True if in the middle of parsing a block comment.
+    self.started_block_comment = False
+
+    # True if in the middle of parsing SQL.
+    self.started_sql = False
+
+    # Comments in the middle of the SQL, which are only kept if more SQL
+    # follows them.
+    self.inline_comment = []
+
+    # The current delimiter.
+    self.delimiter = ";"
+
+    # Whether or not the last line parsed ended with a newline (or no lines have
+    # been parsed yet), in which case there is an empty line at the end.
+    self.ends_with_newline = True
+
+
+  def add_comment(self, line):
+    """
+    Function: add_comment
+    ---------------------
+    Adds a line to the comments.
+    """
+    # If these are comments at the top of the file, ignore them.
+    if self.curr == "":
+      return
+    self.comments[self.curr].append(line + "\n")
+
+
+  def feed(self, line):
+    """
+    Function: feed
+    --------------
+    Parses the next line of the file.
+
+    line: The line, including its newline.
+    """
+    (line, self.delimiter) = sqltools.preprocess_line(line, self.delimiter)
+    if line is not None:
+      self.ends_with_newline = line.endswith("\n")
+      self.parse_line(line[:-1] if self.ends_with_newline else line)
+
+
+  def finish(self):
+    """
+    Function: finish
+    ----------------
+    Finishes parsing the file.
+
+    returns: The dict of the question number and student's response.
+    """
+    if self.ends_with_newline:
+      self.parse_line("")
+
+    responses = {}
+    for curr in self.problems:
+      responses[curr] = Response()
+      responses[curr].comments = "".join(self.comments[curr])
+      responses[curr].sql = "".join(self.sql[curr])
+    return responses
+
+
+  def parse_line(self, line):
+    """
+    Function: parse_line
+    --------------------
+    Parses a line of the file after DELIMITER statements are handled.
+
+    line: The line, without its newline.
+    """
+    # Remove tabs.
+    line = line.replace("\t", "    ")
+
+    # If in the middle of a block comment.
+    if self.started_block_comment:
+      # See if they are now ending the block comment.
+      if line.strip().endswith("*/"):
+        self.started_block_comment = False
+        line = line.replace(" */", "").replace("*/", "").strip()
+      # Strip out leading *'s if they have any.
+      if line.strip().startswith("*"):
+        line = (line[line.find("*") + 1:]).strip()
+      self.add_comment(line)
+
+    # If this is a blank line, just skip it.
+    elif len(line.strip()) == 0:
+      return
+
+    # Indicator denoting the start of an response.
+    elif (line.strip().lower().startswith(PROBLEM_HEADER) and
+          "]" in line and line.index("]") > line.lower().index(PROBLEM_HEADER)):
+      self.started_sql = False
+      curr = line[line.lower().index(PROBLEM_HEADER) + len(PROBLEM_HEADER):
+                  line.index("]")]
+      self.curr = curr.strip()
+      # This is a new problem, so create an empty response to with no comments.
+      if self.curr not in self.sql:
+        self.problems.append(self.curr)
+      self.comments[self.curr] = []
+      self.sql[self.curr] = []
+
+    # Lines with comments of the form "--". Only add this to the comments if it
+    # is before the SQL starts appearing.
+    elif not self.started_sql and line.strip().startswith("--"):
+      self.add_comment(line.replace("-- ", "").replace("--", ""))
+
+    # Block comments of the form /* */.
+    elif line.strip().startswith("/*"):
+      self.started_block_comment = True
+      line = line.replace("/* ", "").replace("/*", "").strip()
+       # See if they are now ending the block comment.
+      if line.strip().endswith("*/"):
+        self.started_block_comment = False
+        line = line.replace(" */", "").replace("*/", "").strip()
+      self.add_comment(line)
+
+    # Inline comment.
+    elif self.started_sql and line.strip().startswith("--"):
+      self.inline_comment.append(line + "\n")
+
+    # SQL code.
+    elif self.started_sql:
+      self.sql[self.curr] += self.inline_comment
+      self.inline_comment = []
+      self.sql[self.curr].append(line + "\n")
+
+    # Continuation of a response from a previous line, or the start of a SQL
+    # statement. This could also contain comments.
+    elif self.curr != "":
+      self.started_sql = True
+      self.sql[self.curr].append(line + "\n")
+      self.inline_comment = []
+
 # ---------------------------------- Other ---------------------------------- #
 
+def fingerprint(*parts):
+  """
+  Function: fingerprint
+  ---------------------
+  Computes a stable hash of one or more JSON-serializable values. Dictionaries
+  are hashed with their keys in sorted order, so the same values always give
+  the same fingerprint.
+
+  parts: The values to hash.
+  returns: The hash as a hex string.
+  """
+  return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str)).hexdigest()
+
+
 def get_students(assignment, after=None):
   """
   Function: get_students
@@ -88,13 +259,41 @@ def get_students(assignment, after=None):
   return [f.replace("-" + assignment, "") for f in files]
 
 
-def output(json_output, specs, raw=False):
+def load_json(string):
+  """
+  Function: load_json
+  -------------------
+  Loads graded output that was stored as JSON. Strings are converted back from
+  unicode to UTF-8 encoded strings, which is what the rest of the tool expects.
+
+  string: The JSON string.
+  returns: The loaded object.
+  """
+
+  def to_str(obj):
+    """
+    Function: to_str
+    ----------------
+    Recursively converts unicode strings into UTF-8 encoded strings.
+    """
+    if isinstance(obj, unicode):
+      return obj.encode("utf-8")
+    elif isinstance(obj, list):
+      return [to_str(x) for x in obj]
+    elif isinstance(obj, dict):
+      return dict([(to_str(k), to_str(v)) for (k, v) in obj.iteritems()])
+    return obj
+
+  return to_str(json.loads(string))
+
+
+def output(graded_output, specs, raw=False):
   """
   Function: output
   ----------------
   Outputs the graded output to a file.
 
-  json_output: The graded output.
+  graded_output: The graded output.
   specs: The assignment specs.
   raw: Whether or not to output as a raw JSON string. True if so, False
        otherwise.
@@ -111,17 +310,35 @@ def output(json_output, specs, raw=False):
   # For the raw, JSON output.
   if raw:
     f = open(path + datetime.now().strftime("%Y-%m-%d+%H;%M;%S") + ".json", "w")
-    f.write(str(json_output))
+    graded_output.write_json(f)
 
   # A nicely formatted HTML file.
   else:
     f = open(path + "index.html", "w")
-    f.write(formatter.format_output(json_output, specs))
+    f.write(formatter.format_output(graded_output.summary(), specs))
 
   f.close()
   return f
 
 
+def ingest(f):
+  """
+  Function: ingest
+  ----------------
+  Style checks and parses a student's file in a single pass over its lines.
+
+  f: The file object to ingest.
+  returns: A tuple of the form (style errors, responses), where the responses
+           are the same as those returned by parse_file.
+  """
+  StyleChecker.start()
+  parser = ResponseParser()
+  for line in f:
+    StyleChecker.feed(line)
+    parser.feed(line)
+  return (StyleChecker.finish(), parser.finish())
+
+
 def parse_file(f):
   """
   Function: parse_file
@@ -133,93 +350,10 @@ def parse_file(f):
   f: The file object to parse.
   returns: The dict of the question number and student's response.
   """
-
-  # Dictionary containing a mapping from the problem number to the response.
-  responses = {}
-  # The current problem number being parsed.
-  curr = ""
-  # True if in the middle of parsing a block comment.
-  started_block_comment = False
-  # True if in the middle of parsing SQL.
-  started_sql = False
-
-  def add_line(line):
-    """
-    Function: add_line
-    ------------------
-    Adds a line to the comments.
-    """
-    # If these are comments at the top of the file, ignore them.
-    if curr == "":
-      return
-    line = line + "\n"
-    responses[curr].comments += line
-
-  inline_comment = ""
-  # Preprocess the file for DELIMITER statements.
-  f = sqltools.preprocess_sql(f)
-  for line in f.split("\n"):
-    # Remove tabs.
-    line = line.replace("\t", "    ")
-
-    # If in the middle of a block comment.
-    if started_block_comment:
-      # See if they are now ending the block comment.
-      if line.strip().endswith("*/"):
-        started_block_comment = False
-        line = line.replace(" */", "").replace("*/", "").strip()
-      # Strip out leading *'s if they have any.
-      if line.strip().startswith("*"):
-        line = (line[line.find("*") + 1:]).strip()
-      add_line(line)
-
-    # If this is a blank line, just skip it.
-    elif len(line.strip()) == 0:
-      continue
-
-    # Indicator denoting the start of an response.
-    elif (line.strip().lower().startswith(PROBLEM_HEADER) and
-          "]" in line and line.index("]") > line.lower().index(PROBLEM_HEADER)):
-      started_sql = False
-      curr = line[line.lower().index(PROBLEM_HEADER) + len(PROBLEM_HEADER):
-                  line.index("]")]
-      curr = curr.strip()
-      # This is a new problem, so create an empty response to with no comments.
-      responses[curr] = Response()
-
-    # Lines with comments of the form "--". Only add this to the comments if it
-    # is before the SQL starts appearing.
-    elif not started_sql and line.strip().startswith("--"):
-      add_line(line.replace("-- ", "").replace("--", ""))
-
-    # Block comments of the form /* */.
-    elif line.strip().startswith("/*"):
-      started_block_comment = True
-      line = line.replace("/* ", "").replace("/*", "").strip()
-       # See if they are now ending the block comment.
-      if line.strip().endswith("*/"):
-        started_block_comment = False
-        line = line.replace(" */", "").replace("*/", "").strip()
-      add_line(line)
-
-    # Inline comment.
-    elif started_sql and line.strip().startswith("--"):
-      inline_comment += line + "\n"
-
-    # SQL code.
-    elif started_sql:
-      responses[curr].sql += inline_comment
-      inline_comment = ""
-      responses[curr].sql += line + "\n"
-
-    # Continuation of a response from a previous line, or the start of a SQL
-    # statement. This could also contain comments.
-    elif curr != "":
-      started_sql = True
-      responses[curr].sql += line + "\n"
-      inline_comment = ""
-
-  return responses
+  parser = ResponseParser()
+  for line in f:
+    parser.feed(line)
+  return parser.finish()
 
 
 def parse_specs(assignment):
@@ -246,7 +380,7 @@ def parse_specs(assignment):
     err("Could not parse spec file!\n" + str(e), True)
 
 
-def prettyprint(results, col_names):
+def prettyprint(results, col_names, truncated=False):
   """
   Function: prettyprint
   ---------------------
@@ -254,6 +388,7 @@ def prettyprint(results, col_names):
 
   results: The results to pretty-print.
   col_names: The column names for the results.
+  truncated: Whether or not there are more results that were never fetched.
   returns: A string contained the pretty-printed results.
   """
   # Make sure the column names are different. If not, add an underscore after
@@ -279,7 +414,8 @@ def prettyprint(results, col_names):
   # and indicate the number of rows that are missing.
   if len(results) > MAX_NUM_RESULTS and len(col_names) >= 1:
     pretty_output.add_row((' ', ) * len(col_names))
-    ellipsis = ('..(%d more)..' % (len(results) - MAX_NUM_RESULTS),) + \
+    ellipsis = ('..(%d%s more)..' % (len(results) - MAX_NUM_RESULTS,
+                                    '+' if truncated else ''),) + \
                ('...',) * (len(col_names) - 1)
     pretty_output.add_row(ellipsis)
 
@@ -0,0 +1,152 @@
+"""
+Module: journal
+---------------
+A journal of the students graded in the current run. Each student's graded
+output is appended to the journal (and flushed to disk) as soon as their output
+has been rendered, so if the tool dies partway through, the run can be resumed
+without grading or rendering those students again. The journal is also where
+the results are read from once grading is done, so graded output never needs to
+be kept in memory.
+"""
+import json
+import os
+
+import iotools
+from CONFIG import ASSIGNMENT_DIR, JOURNAL_FILE, RESULT_DIR
+
+class Journal:
+  """
+  Class: Journal
+  --------------
+  The journal for an assignment. It is a JSON Lines file: the first line
+  identifies the run (the specs and the files being graded) and every other line
+  is the graded output of a student.
+  """
+
+  def __init__(self, assignment, specs, files, resume=False):
+    # The students in the journal.
+    self.students = set()
+
+    # The run the journal is for. A journal can only be resumed by a run
+    # grading the same files with the same specs.
+    run = {"spec": iotools.fingerprint(specs), "files": sorted(files)}
+
+    path = ASSIGNMENT_DIR + assignment + "/" + RESULT_DIR
+    if not os.path.exists(path):
+      os.makedirs(path)
+    self.filename = path + JOURNAL_FILE
+
+    if resume:
+      if self.load(run):
+        self.f = open(self.filename, "a")
+        return
+      iotools.err("Could not resume from %s, it is missing or is for a "
+                  "different run. Starting over." % self.filename)
+      self.students = set()
+
+    self.f = open(self.filename, "w")
+    self.write(run)
+
+
+  def close(self):
+    """
+    Function: close
+    ---------------
+    Closes the journal.
+    """
+    self.f.close()
+
+
+  def __contains__(self, student):
+    return student in self.students
+
+
+  def __len__(self):
+    return len(self.students)
+
+
+  def load(self, run):
+    """
+    Function: load
+    --------------
+    Loads the students in the journal. If the tool died while writing the last
+    line, that line is ignored (the student will be graded again).
+
+    run: The run that is resuming the journal.
+    returns: True if the journal was loaded, False if it does not exist or is
+             for a different run.
+    """
+    try:
+      f = open(self.filename, "r")
+    except IOError:
+      return False
+
+    header = f.readline()
+    try:
+      if iotools.load_json(header) != run:
+        f.close()
+        return False
+    except ValueError:
+      f.close()
+      return False
+
+    valid = len(header)
+    for line in f:
+      if not line.endswith("\n"):
+        break
+      try:
+        entry = iotools.load_json(line)
+      except ValueError:
+        break
+      self.students.add(entry["student"])
+      valid += len(line)
+    f.close()
+
+    # Remove any partially-written line so new entries start on their own line.
+    with open(self.filename, "r+") as f:
+      f.truncate(valid)
+    return True
+
+
+  def outputs(self):
+    """
+    Function: outputs
+    -----------------
+    Reads back the graded output of the students in the journal one at a time,
+    in the order they were rendered.
+
+    returns: A generator of graded output.
+    """
+    with open(self.filename, "r") as f:
+      f.readline()
+      for line in f:
+        if not line.endswith("\n"):
+          break
+        yield iotools.load_json(line)["output"]
+
+
+  def record(self, student, output):
+    """
+    Function: record
+    ----------------
+    Records the graded output of a student in the journal.
+
+    student: The student's name.
+    output: The student's graded output.
+    """
+    self.students.add(student)
+    self.write({"student": student, "output": output})
+
+
+  def write(self, entry):
+    """
+    Function: write
+    ---------------
+    Writes an entry to the journal and makes sure it is on disk before
+    returning.
+
+    entry: The entry to write.
+    """
+    self.f.write(json.dumps(entry) + "\n")
+    self.f.flush()
+    os.fsync(self.f.fileno())
@@ -1,29 +1,36 @@
 import argparse
-import json
-import os
+import collections
+import hashlib
 import sys
+import time
+from StringIO import StringIO
 
 import dbtools
-import formatter
 import iotools
 import traceback
 
 from CONFIG import (
-  ASSIGNMENT_DIR,
   CONNECTION_TIMEOUT,
   MAX_TIMEOUT,
-  STUDENT_DIR,
+  PARSED_FILES_SIZE,
   VERBOSE
 )
 from errors import (
   add,
+  ArchiveError,
   DatabaseError,
   FileNotFoundError
 )
 from grader import Grader
+from journal import Journal
 from iotools import err, log
 from models import GradedOutput
-from stylechecker import StyleChecker
+from pipeline import Prefetcher
+from renderpool import RenderPool
+from resultstore import ResultStore
+from submissions import ArchiveSource, DirectorySource
+from timings import TimingStore
+from verdicts import VerdictStore
 
 class AutomationTool:
   """
@@ -34,12 +41,22 @@ class AutomationTool:
   # Whether or not to run the dependencies.
   dependency = False
 
+  # Whether or not to only grade students whose submissions have changed since
+  # the last run.
+  incremental = False
+
   # Whether or not to purge the database before running the automation tool.
   purge = False
 
+  # Whether or not to resume the last run, skipping the students already graded.
+  resume = False
+
   # Whether or not to output results as raw JSON.
   raw = False
 
+  # Whether or not to use the persistent store of graded output.
+  verdicts = False
+
   def __init__(self):
     # The assignment to grade.
     self.assignment = None
@@ -56,9 +73,21 @@ class AutomationTool:
     # The graded output.
     self.o = None
 
+    # The journal of students graded in this run.
+    self.journal = None
+
+    # The store of graded output from previous runs.
+    self.result_store = None
+
+    # The number of students whose stored graded output was reused.
+    self.reused_students = 0
+
     # The specs file.
     self.specs = None
 
+    # Where the students' files are read from.
+    self.source = None
+
     # The students to grade.
     self.students = None
 
@@ -68,6 +97,27 @@ class AutomationTool:
     # The username for the database connection.
     self.user = None
 
+    # The persistent store of graded output, if it is being used.
+    self.verdict_store = None
+
+    # The background threads rendering the output for graded students.
+    self.render_pool = None
+
+    # The history of how long the solution queries take.
+    self.timings = None
+
+    # The background thread reading and parsing the students' files.
+    self.prefetcher = None
+
+    # The time spent grading students (not including reading their files).
+    self.grade_time = 0.0
+
+    # The style errors and parsed responses of the most recently seen files,
+    # keyed by the hash of their contents, so files that are identical across
+    # students are only parsed once. At most PARSED_FILES_SIZE are kept, least
+    # recently used first, so memory does not grow with the number of students.
+    self.parsed_files = collections.OrderedDict()
+
 
   def get_args(self):
     """
@@ -90,6 +140,10 @@ class AutomationTool:
                                         "grade students who've submitted after "
                                         "that date. Cannot be used with the "
                                         "--students flag")
+    parser.add_argument("--archives", help="Directory of Moodle archives to "
+                                           "read the students' files from "
+                                           "directly, instead of the students' "
+                                           "folders")
     # Database-specific arguments.
     parser.add_argument("--user", help="Username for the database, defaults to "
                                        "a random one in the CONFIG")
@@ -110,12 +164,28 @@ class AutomationTool:
     parser.add_argument("--raw", action="store_const", const=True,
                         help="Whether or not to output results as a raw JSON "
                              "file")
+    parser.add_argument("--verdicts", action="store_const", const=True,
+                        help="Whether or not to reuse graded output of "
+                             "responses seen in previous runs, skipping the "
+                             "database for them")
+    parser.add_argument("--incremental", action="store_const", const=True,
+                        help="Whether or not to only grade students whose "
+                             "submissions, specs or tool version changed since "
+                             "the last run, reusing the stored graded output "
+                             "for everyone else")
+    parser.add_argument("--resume", action="store_const", const=True,
+                        help="Whether or not to resume the last run if it was "
+                             "interrupted, skipping the students it already "
+                             "graded")
     args = parser.parse_args()
     (self.assignment, self.files, self.students, self.start_with, exclude, after,
-     self.user, self.db, AutomationTool.purge, AutomationTool.dependency,
-     AutomationTool.hide_solutions, AutomationTool.raw) = (
+     archives, self.user, self.db, AutomationTool.purge,
+     AutomationTool.dependency, AutomationTool.hide_solutions,
+     AutomationTool.raw, AutomationTool.verdicts, AutomationTool.incremental,
+     AutomationTool.resume) = (
         args.assignment, args.files, args.students, args.startwith, args.exclude,
-        args.after, args.user, args.db, args.purge, args.deps, args.hide, args.raw)
+        args.after, args.archives, args.user, args.db, args.purge, args.deps,
+        args.hide, args.raw, args.verdicts, args.incremental, args.resume)
 
     # If the assignment argument isn't specified, print usage statement.
     if self.assignment is None:
@@ -136,9 +206,16 @@ class AutomationTool:
     if len(self.files) == 0:
       err("No valid files specified for grading!", True)
 
+    # Read the students' files from their archives if given, otherwise from
+    # their folders.
+    if archives is not None:
+      self.source = ArchiveSource(self.assignment, self.files, archives)
+    else:
+      self.source = DirectorySource(self.assignment, self.files)
+
     # If nothing specified for the students, grade all the students.
     if self.students is None or self.students[0] == "*":
-      self.students = iotools.get_students(self.assignment, after)
+      self.students = self.source.get_students(after)
 
     if self.start_with:
       self.start_with = self.start_with[0]
@@ -172,6 +249,11 @@ class AutomationTool:
     if len(self.students) == 0:
       err("No students to grade!")
 
+    # Read and parse the students' files ahead of time, so grading does not wait
+    # on them.
+    self.prefetcher = Prefetcher(
+      self.load_student, [s for s in self.students if s not in self.journal])
+
     i_student = 0
     n_students = len(self.students)
     for student in self.students:
@@ -205,6 +287,13 @@ class AutomationTool:
         possibly_failed_grading.append(student)
 
     log("\n\n=========================END GRADING=========================\n")
+    log("\nReused graded output of identical responses, saving %d test " \
+        "executions.\n" % self.grader.reused_tests)
+    if AutomationTool.incremental:
+      log("Reused stored graded output of %d unchanged students.\n" %
+          self.reused_students)
+    log(self.prefetcher.report() + "\n")
+    log("Spent %.2fs grading.\n" % self.grade_time)
 
     if len(failed_grading) > 0:
       print "\nFAILED GRADING:",
@@ -224,49 +313,111 @@ class AutomationTool:
     """
     log("\n\n%s (%d/%d):" % (student, i_student, n_students))
 
-    # Check to see that this student exists. If not, skip this student.
-    path = ASSIGNMENT_DIR + self.assignment + "/" + STUDENT_DIR + student + \
-           "-" + self.assignment + "/"
-    if not os.path.exists(path):
+    # If resuming, skip students that were already graded in the last run.
+    # Their graded output is already in the journal.
+    if student in self.journal:
+      log("already graded, skipping.")
+      return
+
+    # Get the student's files, which have already been read and parsed while
+    # the previous student was being graded. If the student does not exist,
+    # skip this student.
+    submission = self.prefetcher.get(student)
+    if submission is None:
       err("Student " + student + " does not exist or did not submit!")
       return
 
-    # Graded output for this particular student. Add it to the overall output.
-    output = {"name": student, "files": {}, "got_points": 0}
-    self.o.fields["students"].append(output)
+    # If grading incrementally and the student's submission has not changed,
+    # reuse their stored graded output. If the specs for some problems changed,
+    # only those problems are regraded.
+    (output, only) = (None, None)
+    if AutomationTool.incremental:
+      (output, only) = self.result_store.get(student, submission["hash"])
+      if output is not None and len(only) == 0:
+        log("unchanged, reusing stored graded output.")
+        self.render_pool.submit(student, output, submission["raw_files"])
+        self.reused_students += 1
+        return
+      elif output is not None:
+        log("regrading %d changed problems." % len(only))
+
+    # Graded output for this particular student. It is added to the overall
+    # output once the student is graded. Add each file to the graded output,
+    # unless it is already there from the stored graded output.
+    start = time.time()
+    if output is None:
+      output = {"name": student, "files": {}, "got_points": 0}
+      for filename in self.files:
+        output["files"][filename] = {
+          "filename": filename,
+          "problems": [],
+          "errors": list(submission["errors"][filename]),
+          "got_points": 0
+        }
 
-    # Parse student's response.
-    response = {}
-    for filename in self.files:
-      # Add this file to the graded output.
-      graded_file = {
-        "filename": filename,
-        "problems": [],
-        "errors": [],
-        "got_points": 0
-      }
-      output["files"][filename] = graded_file
-      fname = path + filename
+    # Grade this student, make style deductions, and output the results.
+    output["got_points"] = self.grader.grade(submission["response"], output,
+                                             only)
+    self.render_pool.submit(student, output, submission["raw_files"])
+    self.result_store.put(student, submission["hash"], output,
+                          time.time() - start)
+    self.grade_time += time.time() - start
 
-      try:
-        f = open(fname, "r")
-        # Run their files through the stylechecker to make sure it is valid. Add
-        # the errors to the list of style errors for this file and overall for
-        # this student.
-        graded_file["errors"] += StyleChecker.check(f)
 
-        # Reset back to the beginning of the file.
-        f.seek(0)
-        response[filename] = iotools.parse_file(f)
-        f.close()
+  def load_student(self, student):
+    """
+    Function: load_student
+    ----------------------
+    Reads a student's files, runs them through the stylechecker and parses
+    them. This does not use the database, so it is done ahead of time while
+    the previous students are being graded.
 
-      # If the file does not exist, then they get 0 points.
-      except IOError:
-        add(graded_file["errors"], FileNotFoundError(fname))
+    student: The student's name.
+    returns: A dict with the student's parsed responses ("response"), the
+             contents of their files ("raw_files"), the hash of each file
+             ("file_hashes"), the file errors ("errors") and the hash of their
+             submission ("hash"). None if the student does not exist.
+    """
+    # Check to see that this student exists. If their archive cannot be read,
+    # that is the error for every file instead of the file not being found.
+    archive_error = None
+    try:
+      raw_files = self.source.read(student)
+    except ArchiveError as e:
+      (raw_files, archive_error) = ({}, e)
+    if raw_files is None:
+      return None
 
-    # Grade this student, make style deductions, and output the results.
-    output["got_points"] = self.grader.grade(response, output)
-    formatter.format_student(student, output, self.specs, self.hide_solutions)
+    # Parse student's response.
+    submission = {"response": {}, "raw_files": raw_files, "errors": {},
+                  "file_hashes": {}}
+    for filename in self.files:
+      submission["errors"][filename] = []
+
+      # If the file does not exist, then they get 0 points.
+      if filename not in raw_files:
+        add(submission["errors"][filename], archive_error or
+            FileNotFoundError(self.source.get_path(student, filename)))
+        continue
+
+      # Run their files through the stylechecker to make sure it is valid and
+      # parse them, both in the same pass over the lines. Add the errors to
+      # the list of style errors for this file and overall for this student.
+      # Another student may have submitted the exact same file already.
+      file_hash = hashlib.sha1(raw_files[filename]).hexdigest()
+      submission["file_hashes"][filename] = file_hash
+      parsed = self.parsed_files.pop(file_hash, None)
+      if parsed is None:
+        parsed = iotools.ingest(StringIO(raw_files[filename]))
+      self.parsed_files[file_hash] = parsed
+      if len(self.parsed_files) > PARSED_FILES_SIZE:
+        self.parsed_files.popitem(last=False)
+      (errors, responses) = parsed
+      submission["errors"][filename] += errors
+      submission["response"][filename] = responses
+
+    submission["hash"] = self.result_store.get_hash(submission["file_hashes"])
+    return submission
 
 
   def setup(self):
@@ -277,8 +428,17 @@ class AutomationTool:
     database connection, reading the specs file, sourcing all dependencies,
     and running setup queries.
     """
-    # The graded output.
-    self.o = GradedOutput(self.specs)
+    # The graded output (written to the journal as students are graded), and
+    # the graded output from previous runs.
+    self.journal = Journal(self.assignment, self.specs, self.files,
+                           AutomationTool.resume)
+    self.o = GradedOutput(self.specs, self.journal)
+    self.result_store = ResultStore(self.assignment, self.specs, self.files)
+    # Students are only added to the output (and the journal) once their output
+    # has been rendered, so --resume never skips a student whose HTML is
+    # missing.
+    self.render_pool = RenderPool(self.specs, AutomationTool.hide_solutions,
+                                  self.o.add)
     # Start up the connection with the database.
     self.db = dbtools.DBTools(self.user, self.db)
     try:
@@ -312,7 +472,11 @@ class AutomationTool:
 
     # Initialize the grading tool.
     self.db.get_db_connection(CONNECTION_TIMEOUT)
-    self.grader = Grader(self.assignment, self.specs, self.db)
+    if AutomationTool.verdicts:
+      self.verdict_store = VerdictStore()
+    self.timings = TimingStore(self.assignment)
+    self.grader = Grader(self.assignment, self.specs, self.db,
+                         self.verdict_store, self.timings)
 
 
   def teardown(self):
@@ -322,10 +486,13 @@ class AutomationTool:
     Outputs the results, runs the teardown queries and closes the database
     connection.
     """
+    # Wait for the output of the last students to be rendered.
+    self.render_pool.close()
+    log("\n" + self.render_pool.report() + "\n")
+
     # Output the results to file, but only if there are students to output.
-    json_output = json.loads(self.o.jsonify())
-    if json_output["students"]:
-      f = iotools.output(json_output, self.specs, self.raw)
+    if len(self.o) > 0:
+      f = iotools.output(self.o, self.specs, self.raw)
       log("\n\n==== RESULTS: " + f.name)
 
     # Run teardown queries.
@@ -335,6 +502,11 @@ class AutomationTool:
 
     # Close connection with the database
     self.db.close_db_connection()
+    if self.verdict_store is not None:
+      self.verdict_store.close()
+    self.journal.close()
+    self.result_store.close()
+    self.timings.save()
 
 
 if __name__ == "__main__":
@@ -4,6 +4,7 @@ Module: models
 Contains all models that are passed around and used in the automation tool.
 """
 
+import collections
 import json
 from copy import deepcopy
 from datetime import datetime
@@ -80,34 +81,75 @@ class GradedOutput:
   """
   Class: GradedOutput
   -------------------
-  Contains the graded output. Has functions to convert such output into JSON.
-  Format of the output can be found in the wiki.
+  Contains the graded output. Students are written to the journal as soon as
+  their output is rendered rather than kept in memory, and are streamed back
+  from it to produce the final output. Format of the output can be found in the wiki.
   """
-  def __init__(self, specs):
-    # Dictionary of fields.
+  def __init__(self, specs, journal):
+    # Dictionary of fields, other than the students.
     self.fields = {}
 
     # Set the start time for grading.
     self.fields["start"] = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
 
-    # List of students graded.
-    self.fields["students"] = []
-
     # List of files to grade.
     self.fields["files"] = specs["files"]
 
+    # The journal the graded students are written to.
+    self.journal = journal
+
+
+  def __len__(self):
+    return len(self.journal)
+
+
+  def add(self, student, output):
+    """
+    Function: add
+    -------------
+    Adds a graded student to the output.
 
-  def jsonify(self):
+    student: The student's name.
+    output: The student's graded output.
     """
-    Function: jsonify
+    self.journal.record(student, output)
+
+
+  def summary(self):
+    """
+    Function: summary
     -----------------
-    Convert the output into a JSON object.
+    Gets the output with only the first student graded, which is all that is
+    needed to generate the main page.
+
+    returns: The output as a dict.
+    """
+    summary = dict(self.fields)
+    summary["students"] = []
+    for output in self.journal.outputs():
+      summary["students"].append(output)
+      break
+    return summary
+
+
+  def write_json(self, f):
+    """
+    Function: write_json
+    --------------------
+    Writes the output as JSON to a file, one student at a time.
+
+    f: The file to write to.
     """
     # Set the end time for grading.
     self.fields["end"] = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
 
-    return json.dumps(self.fields, indent=2)
-
+    f.write("{\n")
+    for (key, value) in sorted(self.fields.iteritems()):
+      f.write("  %s: %s,\n" % (json.dumps(key), json.dumps(value)))
+    f.write('  "students": [')
+    for (i, output) in enumerate(self.journal.outputs()):
+      f.write((",\n    " if i > 0 else "\n    ") + json.dumps(output))
+    f.write("\n  ]\n}\n")
 
 
 class Response:
@@ -156,6 +198,10 @@ class Result:
     # Pretty-formatted output to print.
     self.output = ""
 
+    # The canonical forms of the results used to compare them, which are only
+    # computed once (see ProblemType.canonicalize).
+    self.canonical = {}
+
 
   def __repr__(self):
     return self.__str__()
@@ -177,6 +223,7 @@ class Result:
     assert self.col_names == other.col_names or len(other.col_names) == 0
     new_result = deepcopy(self)
     new_result.results += other.results
+    new_result.canonical = {}
     new_result.output = iotools.prettyprint(new_result.results,
                                             new_result.col_names)
     return new_result
@@ -187,7 +234,9 @@ class Result:
     Function: subtract
     ------------------
     Subtracts two results from each other. The schema and column name must be
-    the same. Keeps rows from the current Result.
+    the same. Keeps rows from the current Result, in order. Each row of the
+    other Result cancels out one copy of the same row, so rows that appear more
+    times in the current Result are kept that many extra times.
 
     returns: The newly-modified Result object.
     """
@@ -195,8 +244,23 @@ class Result:
       return self
     assert self.col_names == other.col_names or len(other.col_names) == 0
 
-    new_result = deepcopy(self)
-    results = [row for row in new_result.results if row not in other.results]
+    new_result = Result()
+    new_result.schema = list(self.schema)
+    new_result.col_names = list(self.col_names)
+    new_result.col_types = list(self.col_types)
+
+    try:
+      remaining = collections.Counter(other.results)
+      results = []
+      for row in self.results:
+        if remaining[row] > 0:
+          remaining[row] -= 1
+        else:
+          results.append(row)
+    # Some value cannot be hashed, so fall back to looking for each row.
+    except TypeError:
+      results = [row for row in self.results if row not in other.results]
+
     if len(results) != 0:
       new_result.results = results
       new_result.output = iotools.prettyprint(new_result.results,
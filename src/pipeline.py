@@ -0,0 +1,110 @@
+"""
+Module: pipeline
+----------------
+Stages that let the grading loop overlap work that does not need the database
+with grading, so the database connection is not left waiting on Python. Items
+are loaded ahead of time by a background thread and handed over through a
+bounded queue, in the order they will be graded.
+"""
+import Queue
+import sys
+import threading
+import time
+
+from CONFIG import PREFETCH_DEPTH
+
+class Prefetcher:
+  """
+  Class: Prefetcher
+  -----------------
+  Loads items ahead of time on a background thread. At most a fixed number of
+  loaded items wait in the queue, so the thread never gets too far ahead. Keeps
+  track of how long loading took and how long the consumer had to wait for it.
+  """
+
+  def __init__(self, load, items, depth=PREFETCH_DEPTH):
+    # The function that loads an item.
+    self.load = load
+
+    # Makes sure items are never loaded at the same time, in case loading is not
+    # thread-safe.
+    self.load_lock = threading.Lock()
+
+    # The items that the thread will still hand over, in order.
+    self.remaining = list(items)
+
+    # The loaded items. Each is a tuple of the form (item, result, exception
+    # info), where the exception info is None if loading succeeded.
+    self.queue = Queue.Queue(depth)
+
+    # The number of items loaded, the time spent loading them, and the time the
+    # consumer spent waiting for them.
+    self.loaded = 0
+    self.busy = 0.0
+    self.wait = 0.0
+
+    self.thread = threading.Thread(target=self.work, args=(list(items),))
+    self.thread.daemon = True
+    self.thread.start()
+
+
+  def get(self, item):
+    """
+    Function: get
+    -------------
+    Gets the loaded result for an item. Items should be asked for in the order
+    they were given; items that are skipped are thrown away, and items that were
+    not given (or were already handed over) are loaded right away. If loading an
+    item raised an exception, it is raised again here.
+
+    item: The item.
+    returns: The result of loading the item.
+    """
+    if item not in self.remaining:
+      with self.load_lock:
+        return self.load(item)
+
+    while True:
+      start = time.time()
+      (loaded, result, exc_info) = self.queue.get()
+      self.wait += time.time() - start
+      self.remaining.remove(loaded)
+      if loaded == item:
+        break
+
+    if exc_info is not None:
+      raise exc_info[0], exc_info[1], exc_info[2]
+    return result
+
+
+  def report(self):
+    """
+    Function: report
+    ----------------
+    Gets a summary of the time spent loading items ahead of time.
+
+    returns: The summary as a string.
+    """
+    return ("Prefetched %d students in %.2fs; grading waited %.2fs for them." %
+            (self.loaded, self.busy, self.wait))
+
+
+  def work(self, items):
+    """
+    Function: work
+    --------------
+    Loads each item and puts the result in the queue.
+
+    items: The items to load.
+    """
+    for item in items:
+      start = time.time()
+      (result, exc_info) = (None, None)
+      with self.load_lock:
+        try:
+          result = self.load(item)
+        except Exception:
+          exc_info = sys.exc_info()
+      self.busy += time.time() - start
+      self.loaded += 1
+      self.queue.put((item, result, exc_info))
@@ -29,6 +29,9 @@ class Delete(ProblemType):
       if sql is None:
         return test["points"]
 
+    # Make sure the statement will not take too long before running it.
+    self.check_cost(output, test["query"], sql)
+
     # Start a transaction in order to rollback if this is a self-contained
     # DELETE test.
     self.db.start_transaction()
@@ -47,7 +50,7 @@ class Delete(ProblemType):
       assert len(before.results) == len(self.db.execute_sql(table_sql).results)
 
     # Run the solution delete statement.
-    self.db.execute_sql(test["query"])
+    self.run_solution(test)
     expected = self.db.execute_sql(table_sql)
 
     # A self-contained DELETE. Make sure the rollback occurred properly.
@@ -25,6 +25,10 @@ class Insert(ProblemType):
       if sql is None:
         return test["points"]
 
+    # Make sure the statement will not take too long before running it. This
+    # happens outside the savepoint, so the setup is not run for it.
+    self.check_cost(output, test["query"], sql)
+
     # Start a transaction in order to rollback if this is a self-contained
     # INSERT test.
     self.db.start_transaction()
@@ -45,7 +49,7 @@ class Insert(ProblemType):
       assert len(before.results) == len(self.db.execute_sql(table_sql).results)
 
     # Run the solution insert statement.
-    self.db.execute_sql(test["query"])
+    self.run_solution(test)
     expected = self.db.execute_sql(table_sql)
 
     # A self-contained INSERT. Make sure the rollback occurred properly.
@@ -1,5 +1,11 @@
+import collections
+import time
+
+import iotools
+from CONFIG import MAX_NUM_RESULTS
 from errors import DatabaseError, QueryError
-from sqltools import check_valid_query, find_valid_sql
+from models import Result
+from sqltools import canonicalize, check_valid_query, find_valid_sql
 from types import ProblemType, SuccessType
 
 class Select(ProblemType):
@@ -11,6 +17,10 @@ class Select(ProblemType):
       - Order of rows
       - Order of columns
       - Whether or not derived relations are renamed
+    For ordered tests, the student's rows are compared with the expected rows
+    as they are fetched, and fetching stops once the test has certainly failed.
+    Tests with large results can compare fingerprints of the results computed
+    by the database instead, so rows are only fetched if they differ.
   """
 
   def check_view(self, sql):
@@ -38,40 +48,189 @@ class Select(ProblemType):
     return ("", sql)
 
 
+  def get_query(self):
+    """
+    Function: get_query
+    -------------------
+    Gets the SELECT statement to run for the student's response.
+
+    returns: A tuple of the form (view_sql, valid, sql), where view_sql is the
+             SQL for the view (if any), valid is whether or not the response is
+             a valid query, and sql is the SELECT statement (None if there is
+             none).
+    """
+    (view_sql, sql) = self.check_view(self.response.sql)
+    return (view_sql, check_valid_query(sql, "select"),
+            find_valid_sql(sql, "select"))
+
+
+  def get_reuse_key(self):
+    # Creating a view or running test setup queries modifies the database.
+    (view_sql, valid, sql) = self.get_query()
+    if len(view_sql.strip()) > 0 or \
+       any([test.get("setup") for test in self.specs["tests"]]):
+      return None
+    return (valid, canonicalize(sql) if sql is not None else None)
+
+
+  def compare_fingerprints(self, test, sql):
+    """
+    Function: compare_fingerprints
+    ------------------------------
+    Compares the fingerprints of the results of the test query and the
+    student's query, which the database computes without returning any rows.
+    Only used for tests that have the "fingerprint" flag and are not ordered,
+    since the fingerprints do not depend on the order of the rows. The test
+    query is timed like run_solution, and the student's query is guarded like
+    any other (see DBTools.limit_results).
+
+    test: The specs for the test.
+    sql: The student's query.
+    returns: A tuple of the form (expected column names, actual column names,
+             number of rows) if the fingerprints are the same, None if they are
+             different or could not be computed.
+    """
+    start = time.time()
+    expected = self.db.get_result_fingerprint(test["query"],
+                                              test.get("setup"),
+                                              test.get("teardown"))
+    if expected is None:
+      return None
+    if self.timings is not None:
+      self.timings.record(test, time.time() - start)
+
+    # The student's query never needs to return more than one row past the
+    # expected number of rows.
+    actual = self.db.get_result_fingerprint(sql,
+                                            test.get("setup"),
+                                            test.get("teardown"),
+                                            max_rows=expected[1][0] + 1)
+    if actual is None or expected[1] != actual[1]:
+      return None
+    return (expected[0], actual[0], expected[1][0])
+
+
+  def stream_query(self, test, sql, expected, max_rows):
+    """
+    Function: stream_query
+    ----------------------
+    Runs the student's query and fetches its rows a batch at a time, checking
+    each row against the expected result as it comes in. A row is compared by
+    its values regardless of their order, so once a row turns up that is not in
+    the expected result (or there are more rows than expected), no comparison
+    can succeed, whatever the row or column order. Fetching then stops as soon
+    as there are enough rows to show in the diff.
+
+    test: The specs for the test.
+    sql: The student's query.
+    expected: The expected result.
+    max_rows: The most rows the database may return for the query.
+    returns: The result of the student's query, with only the rows fetched.
+    """
+    # How many times each set of values appears in the expected rows.
+    try:
+      remaining = collections.Counter(
+        frozenset(collections.Counter(row).iteritems())
+        for row in self.canonicalize(expected)
+      )
+    except TypeError:
+      remaining = None
+
+    actual = Result()
+    (rows, mismatch, stopped) = ([], False, False)
+    stream = self.db.stream_sql(sql, actual, test.get("setup"),
+                                test.get("teardown"), max_rows=max_rows)
+    try:
+      for batch in stream:
+        rows += batch
+        if remaining is not None and not mismatch:
+          float_cols = [i for (i, col_type) in enumerate(actual.col_types)
+                        if col_type == float]
+          try:
+            for row in batch:
+              values = frozenset(collections.Counter(
+                self.canonicalize_row(row, float_cols)).iteritems())
+              if remaining[values] == 0:
+                mismatch = True
+                break
+              remaining[values] -= 1
+          except TypeError:
+            remaining = None
+        if mismatch and len(rows) > MAX_NUM_RESULTS:
+          stopped = True
+          break
+    finally:
+      stream.close()
+
+    if len(rows) == 0:
+      return Result()
+    actual.results = rows
+    actual.output = iotools.prettyprint(rows, actual.col_names,
+                                        stopped or len(rows) >= max_rows)
+    return actual
+
+
   def grade_test(self, test, output):
     success = True
     deductions = 0
     test_points = test["points"]
 
-    # See if they suck and did a CREATE VIEW statement.
-    (view_sql, sql) = self.check_view(self.response.sql)
-
-    # Make sure the student did not submit a malicious query or malformed query.
-    if not check_valid_query(sql, "select"):
+    # See if they suck and did a CREATE VIEW statement. Make sure the student
+    # did not submit a malicious query or malformed query.
+    (view_sql, valid, sql) = self.get_query()
+    if not valid:
       output["deductions"].append(QueryError.BAD_QUERY)
-    sql = find_valid_sql(sql, "select")
     if sql is None:
       return test["points"]
 
-    # Run the test query and the student's query.
+    # Run the test query and the student's query. If the fingerprints of their
+    # results are the same, the results are the same and need not be fetched.
     try:
       if len(view_sql.strip()) > 0:
         self.db.execute_sql(view_sql)
-      expected = self.db.execute_sql(test["query"],
+      self.check_cost(output, test["query"], sql, test.get("setup"),
+                      test.get("teardown"))
+      matched = None
+      if test.get("fingerprint") and not test.get("ordered"):
+        matched = self.compare_fingerprints(test, sql)
+      if matched is None:
+        expected = self.run_solution(test,
                                      test.get("setup"),
                                      test.get("teardown"))
-      actual = self.db.execute_sql(sql,
-                                   test.get("setup"),
-                                   test.get("teardown"))
+
+        # The student's query never needs to return more than one row past
+        # the expected number of rows.
+        max_rows = len(expected.results) + 1
+        if test.get("ordered"):
+          actual = self.stream_query(test, sql, expected, max_rows)
+        else:
+          actual = self.db.execute_sql(sql,
+                                       test.get("setup"),
+                                       test.get("teardown"),
+                                       max_rows=max_rows)
+          if len(actual.results) >= max_rows:
+            actual.output = iotools.prettyprint(actual.results,
+                                                actual.col_names, True)
+        output["rows_fetched"] = len(actual.results)
+        if len(actual.results) >= max_rows:
+          output["too_large"] = True
     except DatabaseError:
       raise
 
+    if matched is not None:
+      (expected_col_names, actual_col_names, num_rows) = matched
+      expected_empty = num_rows == 0
+    else:
+      expected_col_names = expected.col_names
+      actual_col_names = actual.col_names
+      expected_empty = len(expected.output) == 0
+
     # Compare the student's code to the results. May not need to check for
     # row order or column order.
-    if not self.equals(expected,
-                       actual,
-                       test.get("ordered"),
-                       test.get("column-order")):
+    if matched is None and not self.equals(expected,
+                                           actual,
+                                           test.get("ordered"),
+                                           test.get("column-order")):
       output["expected"] = expected.output
       output["actual"] = actual.output
       deductions = test_points
@@ -104,19 +263,19 @@ class Select(ProblemType):
 
     # Check to see if they named aggregates.
     if test.get("rename"):
-      for col in actual.col_names:
+      for col in actual_col_names:
         if col.find("(") + col.find(")") != -2:
           output["deductions"].append(QueryError.RENAME_VALUE)
           success = SuccessType.FAILURE
           break
 
     # More or fewer columns included.
-    if len(expected.col_names) != len(actual.col_names):
+    if len(expected_col_names) != len(actual_col_names):
       output["deductions"].append(QueryError.WRONG_NUM_COLUMNS)
 
     # If the expected output is empty, then there is probably something wrong
     # with the state of the database.
-    if len(expected.output) == 0:
+    if expected_empty:
       success = SuccessType.UNDETERMINED
     output["success"] = success
     return deductions
@@ -137,6 +296,9 @@ class Select(ProblemType):
     # Expected and actual output for failed test.
     else:
       o.write("<pre class='results'>")
+      if test.get("too_large"):
+        o.write("Result too large: it has more rows than expected, so only " +
+                "the first %d were fetched.\n\n" % test["rows_fetched"])
       self.generate_diffs(test["expected"].split("\n"),
                           test["actual"].split("\n"),
                           o)
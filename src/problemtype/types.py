@@ -1,18 +1,38 @@
+import collections
 import difflib
+import operator
+import time
 
 import formatter
 
-from CONFIG import PRECISION
+from CONFIG import (
+  CONNECTION_TIMEOUT,
+  EXPLAIN_COST_MULTIPLE,
+  EXPLAIN_MIN_ROWS,
+  NUMPY_MIN_ROWS,
+  PRECISION
+)
 from errors import (
   add,
   DatabaseError,
   MissingKeywordError,
+  QueryCostError,
   TimeoutError,
   QueryError
 )
 
 PRECISION_DIVISOR = float(10 ** PRECISION)
 
+# The most ways of lining up the columns of two results that are tried when
+# the column order does not matter and several columns have the same values.
+MAX_COLUMN_ALIGNMENTS = 24
+
+# NumPy is optional; without it numeric values are always rounded one by one.
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
 class SuccessType(object):
   """
   Class: SuccessType
@@ -33,7 +53,8 @@ class ProblemType(object):
   a static class.
   """
 
-  def __init__(self, assignment=None, db=None, specs=None, response=None, output=None):
+  def __init__(self, assignment=None, db=None, specs=None, response=None, output=None,
+               timings=None):
     # Which assignment this is for.
     self.assignment = assignment
 
@@ -54,6 +75,12 @@ class ProblemType(object):
     # tests go on.
     self.got_points = (0 if not self.specs else self.specs["points"])
 
+    # Whether or not any of the tests timed out while grading.
+    self.timed_out = False
+
+    # The history of how long the solution queries take, if it is being kept.
+    self.timings = timings
+
 
   def get_errors(self, errors, points):
     """
@@ -74,6 +101,20 @@ class ProblemType(object):
     return (deductions if deductions < points else points, error_list)
 
 
+  def get_reuse_key(self):
+    """
+    Function: get_reuse_key
+    -----------------------
+    Gets what the graded output of this response depends on, if grading it
+    leaves the database untouched. If so, the graded output can be reused for
+    other students whose responses have the same key. Problem types that never
+    modify the database should override this.
+
+    returns: The key, or None if grading is not read-only.
+    """
+    return None
+
+
   def preprocess(self):
     """
     Function: preprocess
@@ -118,9 +159,17 @@ class ProblemType(object):
       }
       self.output["tests"].append(graded_test)
 
-      # Set a new connection timeout if specified.
-      if test.get("timeout"):
-        self.db.get_db_connection(test["timeout"])
+      # The deadline is the timeout in the specs (or the default), or longer if
+      # the solution took long enough before. Changing the timeout means a new
+      # connection, which loses the session state of the student's earlier
+      # queries (user variables, temporary tables, savepoints), so it is only
+      # ever raised here. The grader resets it for each student.
+      computed = self.timings.get_timeout(test) if self.timings else None
+      timeout = max(test.get("timeout") or CONNECTION_TIMEOUT, computed)
+      if timeout > self.db.timeout:
+        self.db.get_db_connection(timeout)
+      timeout = self.db.timeout
+      graded_test["timeout"] = timeout
 
       # Grade the test with the specific handler.
       try:
@@ -130,8 +179,9 @@ class ProblemType(object):
       # Retry their query first (so all queries are tried at most twice).
       except TimeoutError as e:
         print "[timed out, trying again]"
+        self.timed_out = True
         self.db.kill_query()
-        self.db.get_db_connection(test.get("timeout"), False)
+        self.db.get_db_connection(timeout, False)
         add(self.output["errors"], e)
 
         # Retry their query. If it still doesn't work, then give up.
@@ -140,7 +190,7 @@ class ProblemType(object):
         except TimeoutError as e:
           lost_points += test["points"]
           self.db.kill_query()
-          self.db.get_db_connection(test.get("timeout"), False)
+          self.db.get_db_connection(timeout, False)
           self.output["got_points"] = 0
           continue
 
@@ -270,61 +320,403 @@ class ProblemType(object):
 
 # ----------------------------- Utility Functions ---------------------------- #
 
+  def run_solution(self, test, setup=None, teardown=None):
+    """
+    Function: run_solution
+    ----------------------
+    Runs the solution query for a test, and records how long it took so the
+    deadline for students' queries can be worked out from it.
+
+    test: The specs for the test.
+    setup: The setup query to run before the solution.
+    teardown: The teardown query to run after the solution.
+    returns: The result of the solution.
+    """
+    start = time.time()
+    result = self.db.execute_sql(test["query"], setup, teardown)
+    if self.timings is not None:
+      self.timings.record(test, time.time() - start)
+    return result
+
+
+  def check_cost(self, output, solution, sql, setup=None, teardown=None):
+    """
+    Function: check_cost
+    --------------------
+    Checks that the student's statement will not take far longer than the
+    solution before it is run, if EXPLAIN_COST_MULTIPLE is set in the CONFIG
+    file. The rows each statement examines are estimated with EXPLAIN, and the
+    EXPLAIN output for the student's statement is added to the graded output
+    for the test. Nothing is checked if either statement cannot be explained.
+
+    output: The graded output for the test.
+    solution: The solution statement.
+    sql: The student's statement.
+    setup: The setup query to run before explaining each statement.
+    teardown: The teardown query to run after explaining each statement.
+    """
+    if EXPLAIN_COST_MULTIPLE is None:
+      return
+    expected = self.db.explain(solution, setup, teardown)
+    if expected is None:
+      return
+    actual = self.db.explain(sql, setup, teardown)
+    if actual is None:
+      return
+
+    output["explain"] = actual[1]
+    output["estimated_rows"] = actual[0]
+    if actual[0] > EXPLAIN_COST_MULTIPLE * max(expected[0], EXPLAIN_MIN_ROWS):
+      raise QueryCostError(actual[0], expected[0])
+
+
+  def canonicalize(self, res):
+    """
+    Function: canonicalize
+    ----------------------
+    Converts a query result into the form it is compared in: each row becomes
+    a tuple with its numeric values rounded to the specified PRECISION in
+    CONFIG.py (NULLs in numeric columns count as 0). The canonical form is kept
+    on the result, so a result is only converted once however many times it is
+    compared.
+
+    res: The result.
+    returns: The list of canonical rows.
+    """
+    if "rows" in res.canonical:
+      return res.canonical["rows"]
+
+    # Round the numeric values.
+    float_cols = [i for (i, col_type) in enumerate(res.col_types)
+                  if col_type == float]
+    if len(float_cols) == 0:
+      rows = [tuple(row) for row in res.results]
+    elif numpy is not None and len(res.results) >= max(NUMPY_MIN_ROWS, 1):
+      rows = self.round_columns(res.results, float_cols)
+    else:
+      rows = [self.canonicalize_row(row, float_cols) for row in res.results]
+    res.canonical["rows"] = rows
+    return rows
+
+
+  def canonicalize_row(self, row, float_cols):
+    """
+    Function: canonicalize_row
+    --------------------------
+    Converts a single row of a query result into its canonical form (see
+    canonicalize).
+
+    row: The row.
+    float_cols: The indices of the numeric columns.
+    returns: The canonical row as a tuple.
+    """
+    row = list(row)
+    for i in float_cols:
+      row[i] = self.round_value(row[i])
+    return tuple(row)
+
+
+  def get_column_signatures(self, res):
+    """
+    Function: get_column_signatures
+    -------------------------------
+    Gets a signature for each column of a query result, which is the same for
+    two columns if they have the same canonical values the same number of
+    times (in any order). Kept on the result like the canonical rows.
+
+    res: The result.
+    returns: A list with the signature of each column. A signature is None if
+             the column's values cannot be hashed.
+    """
+    if "signatures" in res.canonical:
+      return res.canonical["signatures"]
+
+    rows = self.canonicalize(res)
+    signatures = []
+    for i in range(len(res.schema)):
+      try:
+        counts = collections.Counter(map(operator.itemgetter(i), rows))
+        signatures.append(frozenset(counts.iteritems()))
+      except TypeError:
+        signatures.append(None)
+    res.canonical["signatures"] = signatures
+    return signatures
+
+
+  def get_alignments(self, res1, res2):
+    """
+    Function: get_alignments
+    ------------------------
+    Finds the ways the columns of the second result could be reordered to line
+    up with the columns of the first, for when the column order does not
+    matter. A column can only line up with a column that has the same values
+    (see get_column_signatures); among those, a column with the same name is
+    preferred, then the column in the same position. If several columns have
+    the same values, each way of assigning them is a separate alignment (up to
+    MAX_COLUMN_ALIGNMENTS of them), since the rows decide which one is right.
+
+    res1: The first result.
+    res2: The second result.
+    returns: A list of alignments, the best first. Each is a tuple with the
+             index of the column of the second result to use for each column of
+             the first. Empty if the columns cannot be lined up.
+    """
+    signatures1 = self.get_column_signatures(res1)
+    signatures2 = self.get_column_signatures(res2)
+    names1 = [name.lower() for name in res1.col_names]
+    names2 = [name.lower() for name in res2.col_names]
+
+    def matches(i, j):
+      return signatures1[i] is None or signatures2[j] is None or \
+             signatures1[i] == signatures2[j]
+
+    def preference(i, j):
+      return (not (i < len(names1) and j < len(names2) and
+                   names1[i] == names2[j]), i != j, j)
+
+    # The columns of the second result each column of the first can line up
+    # with, best first.
+    candidates = [sorted([j for j in range(len(signatures2)) if matches(i, j)],
+                         key=lambda j: preference(i, j))
+                  for i in range(len(signatures1))]
+
+    alignments = []
+    def assign(i, used, alignment):
+      if len(alignments) >= MAX_COLUMN_ALIGNMENTS:
+        return
+      if i == len(candidates):
+        alignments.append(tuple(alignment))
+        return
+      for j in candidates[i]:
+        if j not in used:
+          used.add(j)
+          assign(i + 1, used, alignment + [j])
+          used.remove(j)
+
+    assign(0, set(), [])
+    return alignments
+
+
+  def search_alignment(self, res1, res2, check_row_order):
+    """
+    Function: search_alignment
+    --------------------------
+    Looks for a way to line up the columns of the second result with the first
+    that makes their rows equal, for when there are too many alignments to try
+    them all (see get_alignments). The columns are lined up one at a time, and
+    only while the rows of both results are equal on the columns lined up so
+    far. Columns of the second result with the same value in every row are
+    interchangeable, so only one of them is tried in each position.
+
+    res1: The first result.
+    res2: The second result.
+    check_row_order: Whether or not to check for the row order of results.
+    returns: True if the rows are equal under some alignment.
+    """
+    rows1 = self.canonicalize(res1)
+    rows2 = self.canonicalize(res2)
+    signatures1 = self.get_column_signatures(res1)
+    signatures2 = self.get_column_signatures(res2)
+    columns2 = [map(operator.itemgetter(j), rows2)
+                for j in range(len(signatures2))]
+
+    def project(rows, cols):
+      return [tuple([row[c] for c in cols]) for row in rows]
+
+    def agree(alignment):
+      projected1 = project(rows1, range(len(alignment)))
+      projected2 = project(rows2, alignment)
+      if check_row_order:
+        return projected1 == projected2
+      try:
+        return collections.Counter(projected1) == \
+               collections.Counter(projected2)
+      except TypeError:
+        pass
+      try:
+        return sorted(projected1) == sorted(projected2)
+      except TypeError:
+        return False
+
+    def assign(alignment):
+      i = len(alignment)
+      if i == len(signatures1):
+        return True
+      tried = []
+      for j in range(len(signatures2)):
+        if j in alignment or columns2[j] in tried:
+          continue
+        if signatures1[i] is not None and signatures2[j] is not None and \
+           signatures1[i] != signatures2[j]:
+          continue
+        tried.append(columns2[j])
+        if agree(alignment + [j]) and assign(alignment + [j]):
+          return True
+      return False
+
+    return assign([])
+
+
+  def align_rows(self, res, alignment):
+    """
+    Function: align_rows
+    --------------------
+    Gets the canonical rows of a query result with its columns reordered.
+
+    res: The result.
+    alignment: The index of the column to use for each position.
+    returns: The list of reordered canonical rows.
+    """
+    rows = self.canonicalize(res)
+    if alignment == tuple(range(len(alignment))):
+      return rows
+    key = ("aligned", alignment)
+    if key not in res.canonical:
+      reorder = operator.itemgetter(*alignment) if len(alignment) > 1 else \
+                lambda row: (row[alignment[0]],)
+      res.canonical[key] = map(reorder, rows)
+    return res.canonical[key]
+
+
+  def round_columns(self, results, float_cols):
+    """
+    Function: round_columns
+    -----------------------
+    Rounds the numeric columns of a large result in bulk with NumPy. Gives
+    exactly the same values as round_value: Python's round rounds halfway cases
+    away from zero, so that is done here too instead of using numpy.round
+    (which rounds them to even). Like round_value, each value (including
+    DECIMAL values) is converted to a float first and NULLs count as 0.
+
+    results: The rows of the result.
+    float_cols: The indices of the numeric columns.
+    returns: The list of rows with their numeric values rounded, as tuples.
+    """
+    cols = [map(operator.itemgetter(i), results)
+            for i in range(len(results[0]))]
+    for i in float_cols:
+      values = [0.0 if val is None else float(val) for val in cols[i]]
+      with numpy.errstate(all="ignore"):
+        scaled = numpy.array(values, dtype=numpy.float64) * PRECISION_DIVISOR
+        magnitude = numpy.abs(scaled)
+        rounded = numpy.floor(magnitude)
+        rounded += (magnitude - rounded) >= 0.5
+        rounded = numpy.copysign(rounded, scaled) / PRECISION_DIVISOR
+      cols[i] = rounded.tolist()
+    return zip(*cols)
+
+
+  def round_value(self, val):
+    """
+    Function: round_value
+    ---------------------
+    Rounds a numeric value to the specified PRECISION in CONFIG.py. NULLs count
+    as 0.
+
+    val: The value.
+    returns: The rounded value as a float.
+    """
+    val = 0.0 if val is None else float(val)
+    return round(val * PRECISION_DIVISOR) / PRECISION_DIVISOR
+
+
+  def count_rows(self, res):
+    """
+    Function: count_rows
+    --------------------
+    Counts how many times each canonical row appears in a query result. Kept on
+    the result like the canonical rows themselves.
+
+    res: The result.
+    returns: A dict from each canonical row to its count, or None if a value
+             cannot be hashed.
+    """
+    if "counts" not in res.canonical:
+      try:
+        res.canonical["counts"] = collections.Counter(self.canonicalize(res))
+      except TypeError:
+        res.canonical["counts"] = None
+    return res.canonical["counts"]
+
+
   def equals(self, res1, res2, check_row_order=False, check_col_order=False):
     """
     Function: equals
     ----------------
-    Compares two query results to see if they are equals.
+    Compares two query results to see if they are equals. Rows are compared in
+    their canonical form (see canonicalize). If the row order does not matter,
+    the results are equal if they have the same rows the same number of times.
+    If the column order does not matter, the columns of the second result are
+    lined up with the columns of the first (see get_alignments) first.
 
     res1: The first result.
     res2: The second result.
     check_row_order: Whether or not to check for the row order of results.
     check_col_order: Whether ot not the check for the column order of results.
     """
-
-    def roundn(val, input_type):
-      """
-      Function: roundn
-      ----------------
-      Rounds numeric values to the specified PRECISION in CONFIG.py if this
-      is a numeric value.
-      """
-      if input_type != float:
-        return val
-      val = 0.0 if val is None else float(val)
-      return round(val * PRECISION_DIVISOR) / PRECISION_DIVISOR
-
-
     # If the results do not have the same number of rows or the same number of,
     # columns, then they are definitely not equal.
     if len(res1.results) != len(res2.results) or \
        len(res1.schema) != len(res2.schema):
       return False
 
-    # Sort the rows if the row order does not matter.
-    lst1 = sorted(res1.results) if not check_row_order else res1.results
-    lst2 = sorted(res2.results) if not check_row_order else res2.results
+    # Most of the time the columns are already in the same order.
+    rows1 = self.canonicalize(res1)
+    if self.equal_rows(res1, rows1, self.canonicalize(res2), check_row_order):
+      return True
+    if check_col_order or len(res1.schema) == 0:
+      return False
 
-    for row1, row2 in zip(lst1, lst2):
-      (row_converted1, row_converted2) = ([], [])
-      for i, (col1, col2) in enumerate(zip(row1, row2)):
-        row_converted1.append(roundn(col1, res1.col_types[i]))
-        row_converted2.append(roundn(col2, res2.col_types[i]))
+    identity = tuple(range(len(res1.schema)))
+    alignments = self.get_alignments(res1, res2)
+    for alignment in alignments:
+      if alignment != identity and \
+         self.equal_rows(res1, rows1, self.align_rows(res2, alignment),
+                         check_row_order):
+        return True
 
-      # If the column order doesn't matter, sort the columns.
-      if not check_col_order:
-        try:
-          row_converted1 = sorted(row_converted1)
-          row_converted2 = sorted(row_converted2)
-        except TypeError as e:
-          print("Couldn't sort columns.")
-          print("row_converted1 = %s" % str(row_converted1))
-          print("row_converted2 = %s" % str(row_converted2))
-          return False
-
-      if row_converted1 != row_converted2:
-        return False
-    return True
+    # The right alignment might not have been among the ones tried.
+    if len(alignments) >= MAX_COLUMN_ALIGNMENTS:
+      return self.search_alignment(res1, res2, check_row_order)
+    return False
+
+
+  def equal_rows(self, res1, rows1, rows2, check_row_order):
+    """
+    Function: equal_rows
+    --------------------
+    Compares the canonical rows of two query results. If the row order does not
+    matter, the rows of the first result are counted once, and each row of the
+    second result is taken away from the counts, stopping at the first row that
+    is not left.
+
+    res1: The first result.
+    rows1: The canonical rows of the first result.
+    rows2: The canonical rows of the second result, with its columns lined up.
+    check_row_order: Whether or not to check for the row order of results.
+    returns: True if the rows are equal.
+    """
+    if check_row_order:
+      return rows1 == rows2
+
+    counts = self.count_rows(res1)
+    if counts is not None:
+      remaining = dict(counts)
+      try:
+        for row in rows2:
+          count = remaining.get(row, 0)
+          if count == 0:
+            return False
+          remaining[row] = count - 1
+        return True
+      except TypeError:
+        pass
+
+    # Some value cannot be hashed, so fall back to comparing sorted rows.
+    try:
+      return sorted(rows1) == sorted(rows2)
+    except TypeError:
+      return False
 
 
   def get_diffs(self, lst1, lst2):
@@ -27,6 +27,9 @@ class Update(ProblemType):
       if sql is None:
         return test["points"]
 
+    # Make sure the statement will not take too long before running it.
+    self.check_cost(output, test["query"], sql)
+
     # Start a transaction in order to rollback if this is a self-contained
     # UPDATE test.
     self.db.start_transaction()
@@ -45,7 +48,7 @@ class Update(ProblemType):
       assert before.output == self.db.execute_sql(table_sql).output
 
     # Run the solution update statement.
-    self.db.execute_sql(test["query"])
+    self.run_solution(test)
     expected = self.db.execute_sql(table_sql)
 
     # A self-contained UPDATE. Make sure the rollback occurred properly.
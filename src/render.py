@@ -0,0 +1,85 @@
+"""
+Module: render
+--------------
+Renders the HTML output from the graded output in the result store, without
+grading again or connecting to the database. Both the TA view and the student
+view (with solutions hidden) can be rendered after a single grading run.
+
+Usage: python render.py --assignment <assignment>
+                        [--students <students to render>]
+                        [--view ta|student|both]
+                        [--archives <directory of Moodle archives>]
+"""
+import argparse
+
+import formatter
+import iotools
+from CONFIG import ASSIGNMENT_DIR, RESULT_DIR
+from errors import ArchiveError
+from resultstore import ResultStore
+from submissions import ArchiveSource
+
+def render(assignment, students=None, views=("ta", "student"), archives=None):
+  """
+  Function: render
+  ----------------
+  Renders the HTML output for the students in the result store.
+
+  assignment: The assignment.
+  students: The students to render, or None for all of them.
+  views: The views to render: "ta" for the TA view (with solutions) and
+         "student" for the student view (with solutions hidden).
+  archives: The directory of Moodle archives the students' files were graded
+            from, or None if they were graded from the students' folders.
+  returns: The number of students rendered.
+  """
+  specs = iotools.parse_specs(assignment)
+  store = ResultStore(assignment, specs)
+  source = ArchiveSource(assignment, specs["files"], archives) \
+           if archives is not None else None
+  first = None
+  rendered = 0
+  for output in store.outputs(students):
+    iotools.log("\n%s" % output["name"])
+    # If their archive cannot be read (which read reports), render them without
+    # their files.
+    try:
+      raw_files = source.read(output["name"]) if source is not None else None
+    except ArchiveError:
+      raw_files = None
+    for view in views:
+      formatter.format_student(output["name"], output, specs, view == "student",
+                               raw_files)
+    if first is None:
+      first = output
+    rendered += 1
+  store.close()
+
+  # The main page for the TA view.
+  if first is not None and "ta" in views:
+    summary = {
+      "files": [f for f in specs["files"] if f in first["files"]],
+      "students": [first]
+    }
+    f = open(ASSIGNMENT_DIR + assignment + "/" + RESULT_DIR + "index.html", "w")
+    f.write(formatter.format_output(summary, specs))
+    f.close()
+  return rendered
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--assignment", required=True,
+                      help="Name of the assignment (cs121hw#)")
+  parser.add_argument("--students", nargs="+", help="Students to render")
+  parser.add_argument("--view", choices=["ta", "student", "both"],
+                      default="both",
+                      help="Whether to render the TA view, the student view "
+                           "(with solutions hidden), or both")
+  parser.add_argument("--archives", help="Directory of Moodle archives the "
+                                         "students' files were graded from")
+  args = parser.parse_args()
+
+  views = ("ta", "student") if args.view == "both" else (args.view,)
+  rendered = render(args.assignment, args.students, views, args.archives)
+  iotools.log("\n\nRendered %d students.\n" % rendered)
@@ -0,0 +1,141 @@
+"""
+Module: renderpool
+------------------
+A pool of background threads that render the HTML output for students, so the
+grading loop can move on to the next student (and keep the database busy)
+while the previous students are being rendered.
+"""
+import Queue
+import threading
+import time
+import traceback
+
+import formatter
+from CONFIG import RENDER_QUEUE_SIZE, RENDER_WORKERS
+from iotools import err
+
+class RenderPool:
+  """
+  Class: RenderPool
+  -----------------
+  The pool of render threads. Students are submitted to a bounded queue once
+  they are graded and rendered in the background. Keeps track of how much of
+  the rendering overlapped with grading.
+  """
+
+  def __init__(self, specs, hide_solutions, done, workers=RENDER_WORKERS):
+    # The specs for the assignment.
+    self.specs = specs
+
+    # Called with the student's name and graded output once a student has been
+    # rendered (by the render threads, one at a time).
+    self.done = done
+
+    # Whether or not to hide solutions from the output.
+    self.hide_solutions = hide_solutions
+
+    # The students waiting to be rendered.
+    self.queue = Queue.Queue(RENDER_QUEUE_SIZE)
+
+    # Protects the counters below and the calls to done, which are made by the
+    # render threads.
+    self.lock = threading.Lock()
+
+    # The number of students rendered and the total time spent rendering.
+    self.rendered = 0
+    self.render_time = 0.0
+
+    # The time the grading loop spent waiting for the queue to have room, and
+    # waiting for the remaining students to be rendered at the end.
+    self.submit_wait = 0.0
+    self.drain_wait = 0.0
+
+    # The students that could not be rendered and why.
+    self.failed = []
+
+    # Create the output folders before the threads start so they don't race to
+    # create them.
+    formatter.create_path(specs["assignment"])
+    self.threads = []
+    for _ in range(workers):
+      thread = threading.Thread(target=self.work)
+      thread.daemon = True
+      thread.start()
+      self.threads.append(thread)
+
+
+  def close(self):
+    """
+    Function: close
+    ---------------
+    Waits for the remaining students to be rendered and stops the threads.
+    """
+    start = time.time()
+    for _ in self.threads:
+      self.queue.put(None)
+    for thread in self.threads:
+      thread.join()
+    self.drain_wait += time.time() - start
+
+    for (student, trace) in self.failed:
+      err("Could not render the output for %s (they will be graded again with "
+          "--resume):\n%s" % (student, trace))
+
+
+  def report(self):
+    """
+    Function: report
+    ----------------
+    Gets a summary of how much rendering overlapped with grading.
+
+    returns: The summary as a string.
+    """
+    overlapped = max(0.0, self.render_time - self.submit_wait - self.drain_wait)
+    return ("Rendered %d students in %.2fs, %.2fs of which overlapped with "
+            "grading (%.2fs waiting for the queue, %.2fs waiting at the end)." %
+            (self.rendered, self.render_time, overlapped, self.submit_wait,
+             self.drain_wait))
+
+
+  def submit(self, student, output, raw_files=None):
+    """
+    Function: submit
+    ----------------
+    Submits a graded student to be rendered. Blocks if the queue is full.
+
+    student: The student's name.
+    output: The student's graded output. It must not be changed afterwards.
+    raw_files: The contents of the student's files keyed by filename, if they
+               have already been read.
+    """
+    start = time.time()
+    self.queue.put((student, output, raw_files))
+    self.submit_wait += time.time() - start
+
+
+  def work(self):
+    """
+    Function: work
+    --------------
+    Renders students from the queue until told to stop. Students that could
+    not be rendered are not passed to done.
+    """
+    while True:
+      job = self.queue.get()
+      if job is None:
+        return
+
+      (student, output, raw_files) = job
+      start = time.time()
+      try:
+        formatter.format_student(student, output, self.specs,
+                                 self.hide_solutions, raw_files)
+        with self.lock:
+          self.rendered += 1
+          self.done(student, output)
+      except Exception:
+        with self.lock:
+          self.failed.append((student, traceback.format_exc()))
+
+      with self.lock:
+        self.render_time += time.time() - start
@@ -0,0 +1,350 @@
+"""
+Module: resultstore
+-------------------
+A store of each student's graded output, backed by a SQLite database in the
+results directory for the assignment. Besides the graded output itself, the
+students, files, problems, tests, errors and timings are stored in their own
+tables so they can be queried directly.
+
+Each student's entry also records a hash of their submitted files, the compiled
+specs (for each problem) and the version of the tool, so students whose
+submissions have not changed since the last run do not need to be graded again,
+and only problems whose specs have changed need to be regraded.
+
+Usage: python resultstore.py <assignment> --failed <file>|<problem> [<test>]
+       python resultstore.py <assignment> --averages
+       python resultstore.py <assignment> --query <SQL>
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import iotools
+from CONFIG import ASSIGNMENT_DIR, RESULT_DIR, RESULT_STORE
+from verdicts import get_problems, problem_key
+
+# The tables in the store.
+SCHEMA = [
+  "CREATE TABLE IF NOT EXISTS students ("
+  "  student TEXT PRIMARY KEY,"
+  "  submission TEXT,"
+  "  spec TEXT,"
+  "  problem_keys TEXT,"
+  "  version TEXT,"
+  "  got_points REAL,"
+  "  seconds REAL,"
+  "  graded REAL,"
+  "  output TEXT)",
+  "CREATE TABLE IF NOT EXISTS files ("
+  "  student TEXT,"
+  "  file TEXT,"
+  "  got_points REAL,"
+  "  PRIMARY KEY (student, file))",
+  "CREATE TABLE IF NOT EXISTS problems ("
+  "  student TEXT,"
+  "  file TEXT,"
+  "  problem TEXT,"
+  "  got_points REAL,"
+  "  notexist INTEGER,"
+  "  seconds REAL,"
+  "  PRIMARY KEY (student, file, problem))",
+  "CREATE INDEX IF NOT EXISTS problems_problem ON problems (file, problem)",
+  "CREATE TABLE IF NOT EXISTS tests ("
+  "  student TEXT,"
+  "  file TEXT,"
+  "  problem TEXT,"
+  "  test INTEGER,"
+  "  success TEXT,"
+  "  got_points REAL,"
+  "  PRIMARY KEY (student, file, problem, test))",
+  "CREATE INDEX IF NOT EXISTS tests_test ON tests (file, problem, test)",
+  "CREATE TABLE IF NOT EXISTS errors ("
+  "  student TEXT,"
+  "  file TEXT,"
+  "  problem TEXT,"
+  "  error TEXT)",
+  "CREATE INDEX IF NOT EXISTS errors_student ON errors (student)"
+]
+
+# The hash of the tool's source code, computed once.
+_TOOL_VERSION = None
+
+def tool_version():
+  """
+  Function: tool_version
+  ----------------------
+  Gets the version of the tool, which is a hash of its source code (including
+  the problem types, the configuration and ../check.py, which has the style
+  rules). Any change to the tool changes the version, so results graded by an
+  older version are not reused.
+
+  returns: The version as a hex string.
+  """
+  global _TOOL_VERSION
+  if _TOOL_VERSION is None:
+    src = os.path.dirname(os.path.abspath(__file__))
+    sources = []
+    for directory in [src, os.path.join(src, "problemtype")]:
+      for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".py"):
+          with open(os.path.join(directory, filename), "r") as f:
+            sources.append((filename, hashlib.sha1(f.read()).hexdigest()))
+    with open(os.path.join(src, os.pardir, "check.py"), "r") as f:
+      sources.append(("check.py", hashlib.sha1(f.read()).hexdigest()))
+    _TOOL_VERSION = iotools.fingerprint(sources)
+  return _TOOL_VERSION
+
+
+def success_name(success):
+  """
+  Function: success_name
+  ----------------------
+  Gets the name of the result of a test, as stored in the tests table.
+
+  success: The result of the test (a SuccessType).
+  returns: SUCCESS, FAILURE or the name of the other result.
+  """
+  if success is True:
+    return "SUCCESS"
+  elif success is False:
+    return "FAILURE"
+  return str(success)
+
+
+class ResultStore:
+  """
+  Class: ResultStore
+  ------------------
+  The store of graded output for an assignment.
+  """
+
+  def __init__(self, assignment, specs, files=None):
+    # The assignment the results are for.
+    self.assignment = assignment
+
+    # The files that are being graded.
+    self.files = files if files is not None else specs["files"]
+
+    # The connection to the store.
+    path = ASSIGNMENT_DIR + assignment + "/" + RESULT_DIR
+    if not os.path.exists(path):
+      os.makedirs(path)
+    self.db = sqlite3.connect(path + RESULT_STORE)
+    for statement in SCHEMA:
+      self.db.execute(statement)
+
+    # The hash of the compiled specs and the version of the tool, which are the
+    # same for every student.
+    self.spec_hash = iotools.fingerprint(specs)
+    self.version = tool_version()
+
+    # The hash of the compiled specs for each problem, keyed by
+    # <file>|<problem number>, and the dependencies of each problem.
+    self.problem_keys = {}
+    self.dependencies = {}
+    for (f, problem) in get_problems(specs):
+      name = f + "|" + problem["number"]
+      self.problem_keys[name] = problem_key(specs, f, problem)
+      self.dependencies[name] = problem.get("dependencies") or []
+
+
+  def close(self):
+    """
+    Function: close
+    ---------------
+    Closes the store.
+    """
+    self.db.close()
+
+
+  def get(self, student, submission_hash):
+    """
+    Function: get
+    -------------
+    Gets the stored graded output for a student, if it was graded from the same
+    submission with the same version of the tool. If the specs have changed
+    since, also gets the problems that need to be regraded: those whose specs
+    (tests, setup, teardown or dependencies, as well as the setup for their file
+    and the assignment) changed, and those that depend on them.
+
+    student: The student's name.
+    submission_hash: The hash of the student's submission.
+    returns: A tuple of the form (graded output, problems to regrade), where the
+             problems are a set of <file>|<problem number>. The graded output is
+             None if there is none or it is out of date.
+    """
+    row = self.db.execute(
+      "SELECT submission, spec, problem_keys, version, output FROM students "
+      "WHERE student=?", (student,)
+    ).fetchone()
+    if row is None or row[0] != submission_hash or row[3] != self.version:
+      return (None, None)
+    output = iotools.load_json(row[4])
+    if row[1] == self.spec_hash:
+      return (output, set())
+
+    # Find the problems whose specs changed, and then the problems that depend
+    # on those.
+    stored_keys = iotools.load_json(row[2])
+    changed = set([name for (name, key) in self.problem_keys.iteritems()
+                   if stored_keys.get(name) != key])
+    while True:
+      dependents = set([name for (name, deps) in self.dependencies.iteritems()
+                        if name not in changed and changed.intersection(deps)])
+      if len(dependents) == 0:
+        break
+      changed |= dependents
+    return (output, changed)
+
+
+  def get_hash(self, file_hashes):
+    """
+    Function: get_hash
+    ------------------
+    Gets the hash of a student's submission, which covers the contents of each
+    file being graded (and whether or not it exists).
+
+    file_hashes: The SHA-1 of the contents of the student's files keyed by
+                 filename. Files that do not exist are left out.
+    returns: The hash as a hex string.
+    """
+    contents = [(filename, file_hashes.get(filename))
+                for filename in sorted(self.files)]
+    return iotools.fingerprint(contents)
+
+
+  def outputs(self, students=None):
+    """
+    Function: outputs
+    -----------------
+    Reads the stored graded output of students one at a time, in alphabetical
+    order.
+
+    students: The students to read, or None for all of them.
+    returns: A generator of graded output.
+    """
+    cursor = self.db.execute("SELECT student, output FROM students "
+                             "ORDER BY student")
+    for (student, output) in cursor:
+      if students is None or student in students:
+        yield iotools.load_json(output)
+
+
+  def put(self, student, submission_hash, output, seconds=None):
+    """
+    Function: put
+    -------------
+    Stores the graded output for a student, replacing anything stored for them
+    before. Everything is replaced in a single transaction so an interrupted run
+    does not leave a partial entry behind.
+
+    student: The student's name.
+    submission_hash: The hash of the student's submission.
+    output: The student's graded output.
+    seconds: How long it took to grade the student.
+    """
+    with self.db:
+      for table in ["students", "files", "problems", "tests", "errors"]:
+        self.db.execute("DELETE FROM %s WHERE student=?" % table, (student,))
+
+      self.db.execute(
+        "INSERT INTO students VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (student, submission_hash, self.spec_hash,
+         json.dumps(self.problem_keys), self.version, output["got_points"],
+         seconds, time.time(), json.dumps(output))
+      )
+      for (filename, graded_file) in output["files"].iteritems():
+        self.db.execute("INSERT INTO files VALUES (?, ?, ?)",
+                        (student, filename, graded_file["got_points"]))
+        for error in graded_file["errors"]:
+          self.db.execute("INSERT INTO errors VALUES (?, ?, NULL, ?)",
+                          (student, filename, error))
+
+        for graded_problem in graded_file["problems"]:
+          num = graded_problem["num"]
+          self.db.execute(
+            "INSERT INTO problems VALUES (?, ?, ?, ?, ?, ?)",
+            (student, filename, num, graded_problem["got_points"],
+             1 if graded_problem.get("notexist") else 0,
+             graded_problem.get("time"))
+          )
+          for (i, graded_test) in enumerate(graded_problem["tests"]):
+            self.db.execute(
+              "INSERT INTO tests VALUES (?, ?, ?, ?, ?, ?)",
+              (student, filename, num, i + 1,
+               success_name(graded_test.get("success")),
+               graded_test.get("got_points"))
+            )
+          for error in graded_problem["errors"]:
+            self.db.execute("INSERT INTO errors VALUES (?, ?, ?, ?)",
+                            (student, filename, num, error))
+
+
+  def query(self, sql, parameters=()):
+    """
+    Function: query
+    ---------------
+    Runs a query against the store.
+
+    sql: The query.
+    parameters: The parameters for the query.
+    returns: A tuple of the form (column names, rows).
+    """
+    cursor = self.db.execute(sql, parameters)
+    col_names = [col[0] for col in cursor.description or []]
+    return (col_names, cursor.fetchall())
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("assignment", help="Name of the assignment (cs121hw#)")
+  parser.add_argument("--failed", nargs="+",
+                      help="Of the form <file>|<problem> [<test>]. Lists the "
+                           "students who failed the problem (or one test)")
+  parser.add_argument("--averages", action="store_const", const=True,
+                      help="Prints the average score for each problem")
+  parser.add_argument("--query", help="Runs a SQL query against the store")
+  args = parser.parse_args()
+
+  store = ResultStore(args.assignment, iotools.parse_specs(args.assignment))
+  (col_names, rows) = ([], [])
+  if args.failed:
+    # Students who did not submit the problem have no tests, but count as
+    # having failed all of them.
+    [filename, problem] = args.failed[0].split("|")
+    if len(args.failed) > 1:
+      (col_names, rows) = store.query(
+        "SELECT p.student, COALESCE(t.got_points, 0) AS got_points "
+        "FROM problems p LEFT JOIN tests t ON t.student=p.student AND "
+        "t.file=p.file AND t.problem=p.problem AND t.test=? "
+        "WHERE p.file=? AND p.problem=? AND "
+        "(p.notexist=1 OR t.success!='SUCCESS') ORDER BY p.student",
+        (int(args.failed[1]), filename, problem)
+      )
+    else:
+      (col_names, rows) = store.query(
+        "SELECT student, got_points FROM problems p "
+        "WHERE file=? AND problem=? AND (notexist=1 OR EXISTS ("
+        "  SELECT 1 FROM tests t WHERE t.student=p.student AND "
+        "  t.file=p.file AND t.problem=p.problem AND t.success!='SUCCESS')) "
+        "ORDER BY student",
+        (filename, problem)
+      )
+  elif args.averages:
+    (col_names, rows) = store.query(
+      "SELECT file, problem, COUNT(*) AS students, AVG(got_points) AS average, "
+      "SUM(notexist) AS missing, AVG(seconds) AS seconds FROM problems "
+      "GROUP BY file, problem ORDER BY file, CAST(problem AS REAL), problem"
+    )
+  elif args.query:
+    (col_names, rows) = store.query(args.query)
+  else:
+    parser.print_help()
+
+  if len(col_names) > 0:
+    print iotools.prettyprint(rows, col_names)
+    print "%d rows" % len(rows)
+  store.close()
@@ -83,6 +83,410 @@ CTRL_KEYWORDS_IGNORE = [
 # Types of quotes.
 QUOTES = ['\'', '\"']
 
+# ----------------------------- Canonicalization ----------------------------- #
+
+# Used to split SQL into tokens when computing its canonical form. Comments and
+# whitespace are dropped, except for MySQL-specific /*! */ and /*+ */ comments
+# which can change the meaning of the query.
+TOKEN_RE = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>--(?=\s|$)[^\n]*|\#[^\n]*|/\*(?![!+]).*?\*/)
+  | (?P<hint>/\*[!+].*?\*/)
+  | (?P<literal>[xXbBnN]'[^']*')
+  | (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+  | (?P<quoted>`(?:[^`]|``)*`)
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?(?![\w$]))
+  | (?P<word>[\w$@]+)
+  | (?P<op><=>|<=|>=|<>|!=|\|\||&&|:=|->>|->|<<|>>|.)
+""", re.X | re.S)
+
+# Plain identifiers, which do not need to be enclosed by backticks.
+IDENTIFIER_RE = re.compile(r"^[A-Za-z_$][\w$]*$")
+
+# Reserved words. These are case-insensitive and cannot be used as unquoted
+# identifiers, so it is safe to uppercase them.
+RESERVED_WORDS = set("""
+  ACCESSIBLE ADD ALL ALTER ANALYZE AND AS ASC BEFORE BETWEEN BIGINT BINARY BLOB
+  BOTH BY CALL CASCADE CASE CHANGE CHAR CHARACTER CHECK COLLATE COLUMN CONDITION
+  CONSTRAINT CONTINUE CONVERT CREATE CROSS CUME_DIST CURRENT_DATE CURRENT_TIME
+  CURRENT_TIMESTAMP CURRENT_USER CURSOR DATABASE DATABASES DAY_HOUR
+  DAY_MICROSECOND DAY_MINUTE DAY_SECOND DEC DECIMAL DECLARE DEFAULT DELAYED
+  DELETE DENSE_RANK DESC DESCRIBE DETERMINISTIC DISTINCT DISTINCTROW DIV DOUBLE
+  DROP DUAL EACH ELSE ELSEIF EMPTY ENCLOSED ESCAPED EXCEPT EXISTS EXIT EXPLAIN
+  FALSE FETCH FIRST_VALUE FLOAT FOR FORCE FOREIGN FROM FULLTEXT FUNCTION GENERATED
+  GET GRANT GROUP GROUPING GROUPS HAVING HIGH_PRIORITY HOUR_MICROSECOND
+  HOUR_MINUTE HOUR_SECOND IF IGNORE IN INDEX INFILE INNER INOUT INSENSITIVE INSERT
+  INT INTEGER INTERSECT INTERVAL INTO IS ITERATE JOIN JSON_TABLE KEY KEYS KILL LAG
+  LAST_VALUE LATERAL LEAD LEADING LEAVE LEFT LIKE LIMIT LINEAR LINES LOAD
+  LOCALTIME LOCALTIMESTAMP LOCK LONG LONGBLOB LONGTEXT LOOP LOW_PRIORITY MATCH
+  MAXVALUE MEDIUMBLOB MEDIUMINT MEDIUMTEXT MIDDLEINT MINUTE_MICROSECOND
+  MINUTE_SECOND MOD MODIFIES NATURAL NOT NO_WRITE_TO_BINLOG NTH_VALUE NTILE NULL
+  NUMERIC OF ON OPTIMIZE OPTION OPTIONALLY OR ORDER OUT OUTER OUTFILE OVER
+  PARTITION PERCENT_RANK PRECISION PRIMARY PROCEDURE PURGE RANGE RANK READ READS
+  READ_WRITE REAL RECURSIVE REFERENCES REGEXP RELEASE RENAME REPEAT REPLACE
+  REQUIRE RESIGNAL RESTRICT RETURN REVOKE RIGHT RLIKE ROW ROWS ROW_NUMBER SCHEMA
+  SCHEMAS SECOND_MICROSECOND SELECT SENSITIVE SEPARATOR SET SHOW SIGNAL SMALLINT
+  SPATIAL SPECIFIC SQL SQLEXCEPTION SQLSTATE SQLWARNING SQL_BIG_RESULT
+  SQL_CALC_FOUND_ROWS SQL_SMALL_RESULT SSL STARTING STORED STRAIGHT_JOIN SYSTEM
+  TABLE TERMINATED THEN TINYBLOB TINYINT TINYTEXT TO TRAILING TRIGGER TRUE UNDO
+  UNION UNIQUE UNLOCK UNSIGNED UPDATE USAGE USE USING UTC_DATE UTC_TIME
+  UTC_TIMESTAMP VALUES VARBINARY VARCHAR VARCHARACTER VARYING VIRTUAL WHEN WHERE
+  WHILE WINDOW WITH WRITE XOR YEAR_MONTH ZEROFILL
+""".split())
+
+# Words that end a WHERE, HAVING or ON clause.
+CLAUSE_END_WORDS = set("""
+  CROSS EXCEPT FOR FULL GROUP HAVING INNER INTERSECT INTO JOIN LEFT LIMIT LOCK
+  NATURAL ON ORDER OUTER PROCEDURE RIGHT STRAIGHT_JOIN UNION USING WHERE WINDOW
+""".split())
+
+# Functions and operators that have side effects or are not deterministic. The
+# order that the conditions they appear in are evaluated can change the result.
+VOLATILE_WORDS = set("""
+  BENCHMARK GET_LOCK LAST_INSERT_ID RAND RELEASE_LOCK SLEEP UUID UUID_SHORT
+""".split())
+
+# Statements that can be canonicalized.
+CANONICAL_STATEMENTS = ["DELETE", "INSERT", "REPLACE", "SELECT", "UPDATE", "WITH"]
+
+def canonicalize(sql):
+  """
+  Function: canonicalize
+  ----------------------
+  Computes the canonical form of SQL, so that responses which are written
+  differently but always give the same results have the same canonical form.
+  The canonical form is only used as a key (for example, for the cache) and is
+  never run. Comments and whitespace are ignored, and for SELECT, INSERT,
+  REPLACE, UPDATE, DELETE and WITH statements, the following are normalized:
+    - The case of reserved words, and backticks around plain identifiers.
+    - The AS keyword before aliases, and trailing semicolons.
+    - Table alias names, which are renamed in the order they are declared.
+    - Parentheses around the statement and around conditions joined by AND.
+    - The order of conditions joined by AND in WHERE, HAVING and ON clauses.
+  For example, these two queries have the same canonical form:
+    select a.x from t as a where (a.y > 1) and a.z = 2;
+    SELECT b.x FROM t b WHERE b.z = 2 AND b.y > 1
+
+  This is conservative. Anything that might change the results, such as
+  reordering conditions with side effects or renaming an alias that might also
+  refer to a table, is left as is.
+
+  sql: The SQL to canonicalize.
+  returns: The canonical form.
+  """
+
+  def is_alias(token):
+    """
+    Function: is_alias
+    ------------------
+    Whether or not a token can be an alias (a plain, non-reserved identifier).
+    """
+    return IDENTIFIER_RE.match(token) is not None and \
+           token.upper() not in RESERVED_WORDS
+
+
+  def is_name(token):
+    """
+    Function: is_name
+    -----------------
+    Whether or not a token can be the name of a table (an alias or a quoted
+    identifier).
+    """
+    return is_alias(token) or token.startswith("`")
+
+
+  def normalize_tokens(tokens):
+    """
+    Function: normalize_tokens
+    --------------------------
+    Uppercases reserved words, removes backticks around plain identifiers, and
+    replaces operators that have more than one spelling.
+    """
+    normalized = []
+    for token in tokens:
+      if token.upper() in RESERVED_WORDS:
+        token = token.upper()
+      elif token.startswith("`") and is_alias(token[1:-1]):
+        token = token[1:-1]
+      elif token == "!=":
+        token = "<>"
+      elif token == "&&":
+        token = "AND"
+      normalized.append(token)
+    return normalized
+
+
+  def remove_as(tokens):
+    """
+    Function: remove_as
+    -------------------
+    Removes the optional AS keyword before aliases. It is only removed if the
+    alias is a plain identifier, since "SELECT 'a' 'b'" is not the same as
+    "SELECT 'a' AS 'b'", and never inside CAST(...) or CONVERT(...), where it
+    comes before a type and is not optional.
+    """
+    result = []
+    in_cast = [False]
+    for (i, token) in enumerate(tokens):
+      if token == "(":
+        in_cast.append(i > 0 and
+                       tokens[i - 1].upper() in ("CAST", "CONVERT"))
+      elif token == ")" and len(in_cast) > 1:
+        in_cast.pop()
+      if token == "AS" and not in_cast[-1] and i + 1 < len(tokens) and \
+         is_alias(tokens[i + 1]):
+        continue
+      result.append(token)
+    return result
+
+
+  def rename_aliases(tokens):
+    """
+    Function: rename_aliases
+    ------------------------
+    Renames table aliases to _t1, _t2, etc. in the order they are declared. An
+    alias is only renamed if it is declared once and every other use of it is
+    as a qualifier (followed by a "."), so it cannot be confused with a table
+    or column of the same name.
+    """
+    # Find the aliases declared after the tables in FROM and JOIN clauses (and
+    # in UPDATE statements).
+    declared = []
+    in_from = [False]
+    for (i, token) in enumerate(tokens):
+      if token == "(":
+        in_from.append(False)
+      elif token == ")":
+        if len(in_from) > 1:
+          in_from.pop()
+        # The alias for a derived table.
+        if in_from[-1] and i + 1 < len(tokens) and is_alias(tokens[i + 1]):
+          declared.append(i + 1)
+      elif token in ["FROM", "JOIN", "UPDATE"] or \
+           (token == "," and in_from[-1]):
+        in_from[-1] = True
+        j = i + 1
+        if j < len(tokens) and is_name(tokens[j]):
+          j += 1
+          # Skip over the rest of a qualified name (database.table).
+          while j + 1 < len(tokens) and tokens[j] == "." and \
+                is_name(tokens[j + 1]):
+            j += 2
+          if j < len(tokens) and is_alias(tokens[j]):
+            declared.append(j)
+      elif token in ["WHERE", "GROUP", "HAVING", "ORDER", "LIMIT", "UNION",
+                     "SET", "WINDOW", "INTO", "FOR", "LOCK", "SELECT",
+                     "VALUES", "EXCEPT", "INTERSECT"]:
+        in_from[-1] = False
+
+    names = [tokens[i] for i in declared]
+    renames = {}
+    for i in declared:
+      alias = tokens[i]
+      if names.count(alias) != 1:
+        continue
+      # Make sure every other use of the alias is as a qualifier.
+      uses = [j for (j, token) in enumerate(tokens) if token == alias and j != i]
+      if all([j + 1 < len(tokens) and tokens[j + 1] == "." and
+              (j == 0 or tokens[j - 1] != ".") for j in uses]):
+        renames[alias] = "_t%d" % (len(renames) + 1)
+
+    # Don't rename anything if the new names are already used.
+    if any([name in tokens for name in renames.values()]):
+      return tokens
+    return [renames.get(token, token) if (i == 0 or tokens[i - 1] != ".") else
+            token for (i, token) in enumerate(tokens)]
+
+
+  def build_tree(tokens):
+    """
+    Function: build_tree
+    --------------------
+    Converts a list of tokens into a tree, where everything in parentheses is
+    put into its own list. Raises a ValueError if the parentheses are not
+    balanced.
+    """
+    stack = [[]]
+    for token in tokens:
+      if token == "(":
+        stack.append([])
+      elif token == ")":
+        if len(stack) == 1:
+          raise ValueError
+        group = stack.pop()
+        stack[-1].append(group)
+      else:
+        stack[-1].append(token)
+    if len(stack) != 1:
+      raise ValueError
+    return stack[0]
+
+
+  def render(nodes):
+    """
+    Function: render
+    ----------------
+    Converts a tree back into a string.
+    """
+    return " ".join([("( " + render(node) + " )") if isinstance(node, list)
+                     else node for node in nodes])
+
+
+  def is_volatile(nodes):
+    """
+    Function: is_volatile
+    ---------------------
+    Whether or not a condition has side effects or is not deterministic, which
+    means that conditions around it cannot be reordered.
+    """
+    for node in nodes:
+      if isinstance(node, list):
+        if is_volatile(node):
+          return True
+      elif node.upper() in VOLATILE_WORDS or node.startswith("@") or \
+           node == ":=":
+        return True
+    return False
+
+
+  def split_conjuncts(nodes):
+    """
+    Function: split_conjuncts
+    -------------------------
+    Splits a condition into the conditions that are joined by AND. Returns None
+    if the condition contains an operator with lower precedence than AND or a
+    CASE expression (in which case it cannot be split safely).
+    """
+    conjuncts = [[]]
+    in_between = False
+    for node in nodes:
+      if not isinstance(node, list):
+        if node in ["OR", "XOR", "||", ",", "CASE"]:
+          return None
+        elif node == "BETWEEN":
+          in_between = True
+        # The AND in "x BETWEEN a AND b" does not join two conditions.
+        elif node == "AND" and in_between:
+          in_between = False
+        elif node == "AND":
+          conjuncts.append([])
+          continue
+      conjuncts[-1].append(node)
+
+    if any([len(conjunct) == 0 for conjunct in conjuncts]):
+      return None
+    return conjuncts
+
+
+  def flatten(conjunct):
+    """
+    Function: flatten
+    -----------------
+    Removes the parentheses around a condition if it is entirely enclosed by
+    them, and splits it into the conditions joined by AND inside.
+    """
+    if len(conjunct) == 1 and isinstance(conjunct[0], list) and \
+       len(conjunct[0]) > 0 and conjunct[0][0] not in ["SELECT", "WITH"]:
+      parts = split_conjuncts(conjunct[0])
+      if parts is not None:
+        return sum([flatten(part) for part in parts], [])
+    return [conjunct]
+
+
+  def is_clause_end(nodes, i):
+    """
+    Function: is_clause_end
+    -----------------------
+    Whether or not the node at index i ends a WHERE, HAVING or ON clause.
+    """
+    node = nodes[i]
+    if isinstance(node, list):
+      return False
+    if node in [",", ";"]:
+      return True
+    # LEFT and RIGHT can also be functions.
+    if node in ["LEFT", "RIGHT"] and i + 1 < len(nodes) and \
+       isinstance(nodes[i + 1], list):
+      return False
+    return node in CLAUSE_END_WORDS
+
+
+  def sort_conditions(nodes):
+    """
+    Function: sort_conditions
+    -------------------------
+    Sorts the conditions joined by AND in each WHERE, HAVING and ON clause,
+    including those in subqueries.
+    """
+    nodes = [sort_conditions(node) if isinstance(node, list) else node
+             for node in nodes]
+    result = []
+    i = 0
+    while i < len(nodes):
+      node = nodes[i]
+      result.append(node)
+      i += 1
+      if isinstance(node, list) or node not in ["WHERE", "HAVING", "ON"]:
+        continue
+      # ON DUPLICATE KEY UPDATE is not a join condition.
+      if node == "ON" and i < len(nodes) and \
+         not isinstance(nodes[i], list) and nodes[i].upper() == "DUPLICATE":
+        continue
+
+      # Find the end of the clause.
+      end = i
+      while end < len(nodes) and not is_clause_end(nodes, end):
+        end += 1
+      clause = nodes[i:end]
+      conjuncts = split_conjuncts(clause)
+      if conjuncts is not None and not is_volatile(clause):
+        conjuncts = sorted(sum([flatten(c) for c in conjuncts], []), key=render)
+        clause = conjuncts[0]
+        for conjunct in conjuncts[1:]:
+          clause = clause + ["AND"] + conjunct
+      result += clause
+      i = end
+    return result
+
+
+  def canonicalize_statement(tokens):
+    """
+    Function: canonicalize_statement
+    --------------------------------
+    Computes the canonical form of a single statement.
+    """
+    tokens = normalize_tokens(tokens)
+    first = [token for token in tokens if token != "("][:1]
+    if len(first) == 0 or first[0] not in CANONICAL_STATEMENTS:
+      return " ".join(tokens)
+
+    tokens = rename_aliases(remove_as(tokens))
+    try:
+      nodes = build_tree(tokens)
+    except ValueError:
+      return " ".join(tokens)
+
+    # Remove parentheses around the entire statement.
+    while len(nodes) == 1 and isinstance(nodes[0], list):
+      nodes = nodes[0]
+    return render(sort_conditions(nodes))
+
+  tokens = tokenize(sql)
+  # If there is an unterminated string, don't try to do anything else.
+  if any([token in ["'", "\"", "`"] for token in tokens]):
+    return normalize_sql(sql)
+
+  # Canonicalize each statement separately.
+  statements = [[]]
+  for token in tokens:
+    if token == ";":
+      statements.append([])
+    else:
+      statements[-1].append(token)
+  return "; ".join([canonicalize_statement(statement)
+                    for statement in statements if len(statement) > 0])
+
+
 def check_valid_query(query, query_type):
   """
   Function: check_valid_query
@@ -302,6 +706,48 @@ def split(raw_sql):
   return sql_list
 
 
+def normalize_sql(sql):
+  """
+  Function: normalize_sql
+  -----------------------
+  Normalizes the whitespace in a SQL statement so that responses which only
+  differ in spacing can be recognized as the same response. Runs of whitespace
+  outside of quotes are collapsed into a single space, and leading and trailing
+  whitespace and semicolons are removed. For example, these two queries have
+  the same normalized form:
+    SELECT a,   b FROM t;
+    SELECT a, b
+    FROM t
+
+  sql: The SQL to normalize.
+  returns: The normalized SQL.
+  """
+  chars = []
+  quote = None
+  prev_char = ""
+  for char in sql:
+    if quote is None and char.isspace():
+      # Only keep a single space for each run of whitespace.
+      if prev_char != " ":
+        chars.append(" ")
+      prev_char = " "
+      continue
+
+    # Keep track of whether or not we are within quotes.
+    if char in QUOTES and prev_char != "\\":
+      if quote is None:
+        quote = char
+      elif quote == char:
+        quote = None
+    chars.append(char)
+    prev_char = char
+
+  normalized = "".join(chars).strip()
+  while normalized.endswith(";"):
+    normalized = normalized[:-1].rstrip()
+  return normalized
+
+
 def parse_create(sql):
   """
   Function: parse_create
@@ -393,6 +839,29 @@ def parse_func_and_proc(full_sql, is_procedure=False):
   return "".join(sql_lines)
 
 
+def preprocess_line(line, delimiter):
+  """
+  Function: preprocess_line
+  -------------------------
+  Preprocess a single line of SQL in order to handle the DELIMITER statements.
+
+  line: The line to preprocess.
+  delimiter: The current delimiter.
+  returns: A tuple of the form (line, delimiter) with the newly-processed line
+           and the delimiter for the following lines. The line is None if it is
+           a DELIMITER statement.
+  """
+  # See if there is a new delimiter.
+  match = DELIMITER_RE.match(line)
+  if match:
+    return (None, match.group(1))
+
+  # If we've reached the end of a statement.
+  if line.strip().endswith(delimiter):
+    line = line.replace(delimiter, ";")
+  return (line, delimiter)
+
+
 def preprocess_sql(sql_file):
   """
   Function: preprocess_sql
@@ -405,20 +874,9 @@ def preprocess_sql(sql_file):
   lines = StringIO()
   delimiter = ';'
   for line in sql_file:
-    # See if there is a new delimiter.
-    match = re.match(DELIMITER_RE, line)
-    if match:
-      # if VERBOSE:
-      #   print("preprocess_sql():  Matched DELIMITER spec line:  %s" % line)
-      delimiter = match.group(1)
-      continue
-
-    # If we've reached the end of a statement.
-    if line.strip().endswith(delimiter):
-      line = line.replace(delimiter, ";")
-    lines.write(line)
-    # if VERBOSE:
-    #   print("Appended line to lines:  %s" % line)
+    (line, delimiter) = preprocess_line(line, delimiter)
+    if line is not None:
+      lines.write(line)
 
   return lines.getvalue()
 
@@ -444,3 +902,17 @@ def remove_comments(in_sql):
       continue
     sql.append(line)
   return "\n".join(sql)
+
+
+def tokenize(sql):
+  """
+  Function: tokenize
+  ------------------
+  Splits SQL into tokens. Whitespace and comments are removed, but quoted
+  strings and identifiers are kept as single tokens.
+
+  sql: The SQL to tokenize.
+  returns: A list of tokens.
+  """
+  return [match.group() for match in TOKEN_RE.finditer(sql)
+          if match.lastgroup not in ["space", "comment"]]
@@ -1,38 +1,25 @@
 import collections
-import re
 
+import stylerules
 from errors import StyleError
 
-MAX_LINE_LENGTH = 80
-
-S                   = r"[^\>\<\=\(\) \t\n\r\f\v]"
-
-header              = re.compile(r"-- \[Problem (([0-9])+([a-zA-Z])*|[a-zA-Z])\]")
-bad_header          = re.compile(r"-- \[Problem([^\]])*\]")
-comment             = re.compile(r"\s*--.|/\*.|\*/.")
-tabs                = re.compile(r"\t+")
-comma_space         = re.compile(r",[^ ][^\n]")
-negative_num        = re.compile(r"\-([0-9]*\.?[0-9]+)")
-count_star          = re.compile(r"\(\*\)|\(DISTINCT \*\)")
-double_quote        = re.compile(r"\"([^\"])*\"")
-
 class StyleChecker:
   """
   Class: StyleChecker
   -------------------
   Stylechecker for student submissions. Takes points off for violations. The
-  regular expressions must be kept in sync with the ../check.py file.
+  rules are shared with the ../check.py file (see stylerules).
   """
-  # Whether or not a problem header has been encountered.
-  has_header = False
-
-  # If in a multi-line comment.
-  multiline_comment = False
+  # Checks the lines of the current file against the rules.
+  rules = stylerules.RuleChecker()
 
   # Dictionary where the key is the error name and the value is the number of
   # times that error occurred.
   errors = collections.defaultdict(int)
 
+  # The number of lines checked so far.
+  num_lines = 0
+
   @classmethod
   def check(cls, f):
     """
@@ -43,69 +30,58 @@ class StyleChecker:
     f: The file to check.
     returns: A list of style errors.
     """
+    cls.start()
+    for line in f.readlines():
+      cls.feed(line)
+    return cls.finish()
+
+
+  @classmethod
+  def start(cls):
+    """
+    Function: start
+    ---------------
+    Starts checking a new file, one line at a time with feed.
+    """
+    cls.rules = stylerules.RuleChecker()
     cls.errors = collections.defaultdict(int)
-    lines = f.readlines()
-    num_lines = len(lines)
+    cls.num_lines = 0
 
-    # Check for encoding.
-    try:
-      "\n".join(lines).decode('utf-8')
-    except UnicodeDecodeError:
-      cls.errors[StyleError.WRONG_ENCODING] += 1
 
-    # Check every line.
-    for i in range(num_lines):
-      line = lines[i][:-1]
-      cls.check_line(line)
+  @classmethod
+  def feed(cls, line):
+    """
+    Function: feed
+    --------------
+    Checks the next line of the file.
+
+    line: The line, including its newline.
+    """
+    cls.num_lines += 1
 
-    error_list = []
-    for e in cls.errors:
-      string = StyleError.to_string(e, cls.errors[e], num_lines)
-      error_list.append(string)
-    return error_list
+    # Check for encoding.
+    if not cls.errors.get(StyleError.WRONG_ENCODING):
+      try:
+        line.decode('utf-8')
+      except UnicodeDecodeError:
+        cls.errors[StyleError.WRONG_ENCODING] += 1
+
+    for violation in cls.rules.check_line(line[:-1]):
+      cls.errors[getattr(StyleError, violation)] += 1
 
 
   @classmethod
-  def check_line(cls, line):
+  def finish(cls):
     """
-    Function: check_line
-    --------------------
-    Checks a line of a file for style violations.
+    Function: finish
+    ----------------
+    Finishes checking the file.
 
-    line: The line to check.
-    line_number: The line number of the line to check.
+    returns: A list of style errors.
     """
-    is_bad_header = False
-
-    if not len(line.strip()):
-      return
-
-    # Check for problem header formatting errors (cannot have code before a
-    # problem header).
-    if not cls.has_header and header.search(line):
-      cls.has_header = True
-    if not cls.has_header and line.strip().startswith("/*"):
-      cls.multiline_comment = True
-
-    # Check for style mistakes.
-    if bad_header.search(line) and not header.search(line):
-      cls.errors[StyleError.BAD_HEADER] += 1
-      is_bad_header = True
-    if tabs.search(line):
-      cls.errors[StyleError.USED_TABS] += 1
-    if len(line) > MAX_LINE_LENGTH:
-      cls.errors[StyleError.LINE_TOO_LONG] += 1
-    if not cls.multiline_comment and not comment.search(line):
-      if comma_space.search(line):
-        cls.errors[StyleError.SPACING] += 1
-      if double_quote.search(line):
-        cls.errors[StyleError.DOUBLE_QUOTES] += 1
-
-    # Continue checking for problem header mistakes.
-    if not (cls.has_header or
-            cls.multiline_comment or
-            is_bad_header or
-            comment.search(line.strip())):
-      cls.errors[StyleError.CODE_BEFORE_PROBLEM_HEADER] += 1
-    if line.strip().startswith("*/") or line.strip().endswith("*/"):
-      cls.multiline_comment = False
+    error_list = []
+    for e in cls.errors:
+      string = StyleError.to_string(e, cls.errors[e], cls.num_lines)
+      error_list.append(string)
+    return error_list
+
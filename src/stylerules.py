@@ -0,0 +1,28 @@
+"""
+Module: stylerules
+------------------
+The style rules for student submissions, used by the stylechecker when grading.
+They are declared once, in ../check.py: students run that file on its own, so
+it cannot import anything from here, and the rules are loaded from it instead.
+"""
+import imp
+import os
+
+# The style checker the students run, which declares the rules.
+CHECK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          os.pardir, "check.py")
+check = imp.load_source("check", CHECK_FILE)
+
+MAX_LINE_LENGTH = check.MAX_LINE_LENGTH
+
+# The violations a line can have. The names are the same as the StyleErrors
+# they correspond to.
+BAD_HEADER = check.BAD_HEADER
+CODE_BEFORE_PROBLEM_HEADER = check.CODE_BEFORE_PROBLEM_HEADER
+DOUBLE_QUOTES = check.DOUBLE_QUOTES
+LINE_TOO_LONG = check.LINE_TOO_LONG
+SPACING = check.SPACING
+USED_TABS = check.USED_TABS
+
+is_comment = check.is_comment
+RuleChecker = check.RuleChecker
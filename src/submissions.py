@@ -0,0 +1,194 @@
+"""
+Module: submissions
+-------------------
+Where the students' submitted files are read from. They are either read from
+the students' folders (where unpack_for_automation.py extracts them), or read
+straight out of the Moodle archives the students submitted, without extracting
+them to disk first.
+"""
+import os
+import sys
+import tarfile
+import time
+import zipfile
+import zlib
+
+import iotools
+import unpack_for_automation
+from CONFIG import ASSIGNMENT_DIR, STUDENT_DIR
+from errors import ArchiveError
+from iotools import err
+from unpack_for_automation import SubmissionError
+
+def archive_errors():
+  """
+  Function: archive_errors
+  ------------------------
+  Gets the errors that can be raised while reading an archive. The errors of
+  the rarfile module are only included if it has been imported (it is only
+  imported to read RAR archives).
+
+  returns: A tuple of exception classes.
+  """
+  errors = (SubmissionError, EnvironmentError, tarfile.TarError,
+            zipfile.BadZipfile, zlib.error)
+  rarfile = sys.modules.get("rarfile")
+  if rarfile is not None:
+    errors += (rarfile.Error,)
+  return errors
+
+class DirectorySource:
+  """
+  Class: DirectorySource
+  ----------------------
+  Reads submissions from the students' folders for the assignment.
+  """
+
+  def __init__(self, assignment, files):
+    # The assignment the submissions are for.
+    self.assignment = assignment
+
+    # The files to read from each submission.
+    self.files = files
+
+
+  def get_path(self, student, filename):
+    """
+    Function: get_path
+    ------------------
+    Gets the path of a student's file.
+
+    student: The student's name.
+    filename: The name of the file.
+    returns: The path of the file.
+    """
+    return ASSIGNMENT_DIR + self.assignment + "/" + STUDENT_DIR + student + \
+           "-" + self.assignment + "/" + filename
+
+
+  def get_students(self, after=None):
+    """
+    Function: get_students
+    ----------------------
+    Gets the students who submitted the assignment.
+
+    after: The date after which to find submissions, of the form YYYY-MM-DD.
+    returns: A list of the students.
+    """
+    return iotools.get_students(self.assignment, after)
+
+
+  def read(self, student):
+    """
+    Function: read
+    --------------
+    Reads a student's files.
+
+    student: The student's name.
+    returns: The contents of the student's files keyed by filename. Files that
+             do not exist are left out. None if the student does not exist.
+    """
+    if not os.path.exists(self.get_path(student, "")):
+      return None
+
+    contents = {}
+    for filename in self.files:
+      try:
+        with open(self.get_path(student, filename), "r") as f:
+          contents[filename] = f.read()
+      except IOError:
+        pass
+    return contents
+
+
+class ArchiveSource:
+  """
+  Class: ArchiveSource
+  --------------------
+  Reads submissions straight out of a directory of Moodle archives, the same
+  way unpack_for_automation.py does, but keeps the files in memory instead of
+  writing them to the students' folders.
+  """
+
+  def __init__(self, assignment, files, directory):
+    # The assignment the submissions are for.
+    self.assignment = assignment
+
+    # The files to read from each submission.
+    self.files = files
+
+    # The archive each student submitted, found by parsing the names of the
+    # archives in the directory.
+    self.archives = {}
+    for name in sorted(os.listdir(directory)):
+      path = os.path.join(directory, name)
+      if not os.path.isfile(path):
+        continue
+      try:
+        (student, hwname, _) = \
+          unpack_for_automation.parse_submission_filename(path)
+      except SubmissionError:
+        continue
+      if hwname != assignment:
+        continue
+      if student in self.archives:
+        err("%s submitted more than one archive, using %s." % (student, name))
+      self.archives[student] = path
+
+
+  def get_path(self, student, filename):
+    """
+    Function: get_path
+    ------------------
+    Gets the path of a student's file, within their archive.
+
+    student: The student's name.
+    filename: The name of the file.
+    returns: The path of the file.
+    """
+    return self.archives.get(student, student) + ":" + filename
+
+
+  def get_students(self, after=None):
+    """
+    Function: get_students
+    ----------------------
+    Gets the students who submitted the assignment.
+
+    after: The date after which to find submissions, of the form YYYY-MM-DD.
+    returns: A list of the students.
+    """
+    students = sorted(self.archives.keys())
+    if after is not None:
+      try:
+        after = time.mktime(time.strptime(after, "%Y-%m-%d"))
+        students = [s for s in students
+                    if os.path.getmtime(self.archives[s]) >= after]
+      except ValueError:
+        err("'after' parameter not formatted correctly (must be YYYY-MM-DD)")
+    return students
+
+
+  def read(self, student):
+    """
+    Function: read
+    --------------
+    Reads a student's files out of their archive.
+
+    student: The student's name.
+    returns: The contents of the student's files keyed by filename. Files that
+             are not in the archive are left out. None if the student does not
+             have an archive.
+    raises: ArchiveError if the archive cannot be read.
+    """
+    if student not in self.archives:
+      return None
+
+    warnings = []
+    try:
+      (_, _, contents) = unpack_for_automation.read_submission(
+        self.archives[student], self.files, warnings)
+    except archive_errors() as e:
+      err("Could not read the archive for %s: %s" % (student, str(e)))
+      raise ArchiveError(self.archives[student], getattr(e, "problem", str(e)))
+    return contents
@@ -0,0 +1,105 @@
+"""
+Module: timings
+---------------
+A history of how long the solution query of each test takes to run, kept in a
+JSON file in the results directory for the assignment so it carries over from
+run to run. The deadline for a student's query is extended beyond the timeout
+in the specs when the solution takes long enough.
+"""
+import json
+import math
+import os
+
+import iotools
+from CONFIG import (
+  ASSIGNMENT_DIR,
+  MAX_TIMEOUT,
+  MIN_TIMEOUT,
+  RESULT_DIR,
+  TIMEOUT_MULTIPLE,
+  TIMING_HISTORY,
+  TIMING_STORE
+)
+
+def test_key(test):
+  """
+  Function: test_key
+  ------------------
+  Gets the key the runtimes of a test are stored under, which is a hash of its
+  solution query and setup. Tests running the same solution the same way take
+  the same time, so they share their history.
+
+  test: The specs for the test.
+  returns: The key as a hex string.
+  """
+  return iotools.fingerprint(test.get("query"), test.get("setup"))
+
+
+class TimingStore:
+  """
+  Class: TimingStore
+  ------------------
+  The history of solution runtimes for an assignment.
+  """
+
+  def __init__(self, assignment):
+    # The file the history is kept in.
+    path = ASSIGNMENT_DIR + assignment + "/" + RESULT_DIR
+    if not os.path.exists(path):
+      os.makedirs(path)
+    self.filename = path + TIMING_STORE
+
+    # The most recent runtimes (in seconds) of each solution, keyed by
+    # test_key.
+    self.runtimes = {}
+    try:
+      with open(self.filename, "r") as f:
+        self.runtimes = json.load(f)
+    except (IOError, ValueError):
+      pass
+
+
+  def get_timeout(self, test):
+    """
+    Function: get_timeout
+    ---------------------
+    Gets the deadline for a student's query in a test: TIMEOUT_MULTIPLE times
+    the slowest recent runtime of the solution, but at least MIN_TIMEOUT and at
+    most MAX_TIMEOUT seconds.
+
+    test: The specs for the test.
+    returns: The deadline in whole seconds, or None if it is not worked out
+             (TIMEOUT_MULTIPLE is not set or the solution has not run yet).
+    """
+    runtimes = self.runtimes.get(test_key(test))
+    if TIMEOUT_MULTIPLE is None or not runtimes:
+      return None
+    timeout = int(math.ceil(TIMEOUT_MULTIPLE * max(runtimes)))
+    return min(max(timeout, MIN_TIMEOUT), MAX_TIMEOUT)
+
+
+  def record(self, test, seconds):
+    """
+    Function: record
+    ----------------
+    Records how long the solution query of a test took to run. Only the last
+    TIMING_HISTORY runtimes are kept.
+
+    test: The specs for the test.
+    seconds: How long the solution took.
+    """
+    runtimes = self.runtimes.setdefault(test_key(test), [])
+    runtimes.append(seconds)
+    del runtimes[:-TIMING_HISTORY]
+
+
+  def save(self):
+    """
+    Function: save
+    --------------
+    Saves the history, replacing the file atomically so an interrupted run
+    never leaves a half-written one behind.
+    """
+    with open(self.filename + ".tmp", "w") as f:
+      json.dump(self.runtimes, f, indent=2, sort_keys=True)
+    os.rename(self.filename + ".tmp", self.filename)
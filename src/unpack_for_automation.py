@@ -1,5 +1,24 @@
-import json, shutil, sys, os
-import tarfile, zipfile, rarfile
+import argparse, collections, hashlib, json, multiprocessing, shutil, sys, os, tempfile, time
+import tarfile, zipfile
+
+
+# Where the state of the last run is kept, so archives that have not changed
+# since then are not extracted again.
+MANIFEST_FILENAME = 'students/.unpacked.json'
+
+# The size of the buffer used when copying members out of archives.
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Where the extracted files are stored, each once, named by the hash of their
+# contents.  The files in the students' folders are copies from this store.
+OBJECTS_DIR = 'students/.objects'
+
+# The first bytes of every RAR archive.
+RAR_SIGNATURE = 'Rar!\x1a\x07'
+
+# The name of the manifest in each student's folder, which maps each extracted
+# file to the hash of its contents.
+STUDENT_MANIFEST_FILENAME = '.manifest.json'
 
 
 class SubmissionError(Exception):
@@ -29,12 +48,15 @@ def load_spec_file(spec_filename):
         return json.load(f)
 
 
-def process_submission(moodle_filename, files_to_extract, warnings):
-    initial_warnings = len(warnings)
+def parse_submission_filename(moodle_filename):
+    '''
+    Parse the name of a Moodle submission archive into the student's username,
+    the name of the assignment and the archive's extension.
+    '''
 
     # Parse the Moodle submission filename
 
-    moodle_parts = moodle_filename.split('_')
+    moodle_parts = os.path.basename(moodle_filename).split('_')
 
     if len(moodle_parts) == 3:
         student_name = moodle_parts[0]
@@ -78,6 +100,19 @@ def process_submission(moodle_filename, files_to_extract, warnings):
         raise SubmissionError(moodle_filename, 'Student submission filename ' \
             'doesn\'t seem to follow required naming convention.')
 
+    return (username, hwname, extension)
+
+
+def process_submission(moodle_filename, files_to_extract, warnings):
+    '''
+    Extract the required files from a student's Moodle submission into their
+    folder under students/.  The files are stored once in the object store and
+    copied into the folder, and the folder's manifest records their hashes.
+    Returns the target path and the hash of each extracted file.
+    '''
+    initial_warnings = len(warnings)
+    (username, hwname, extension) = parse_submission_filename(moodle_filename)
+
     # Create the target path for where files will be extracted to
 
     # This is where the files will be extracted to.
@@ -89,6 +124,93 @@ def process_submission(moodle_filename, files_to_extract, warnings):
     if not os.path.isdir(target_path):
         os.makedirs(target_path)
 
+    objects = {}
+
+    def copy_member(fname, src_file):
+        objects[fname] = store_object(src_file)
+        copy_object(objects[fname], target_path + '/' + fname)
+
+    read_members(moodle_filename, extension, files_to_extract, copy_member,
+                 warnings)
+    with open(target_path + '/' + STUDENT_MANIFEST_FILENAME, 'w') as f:
+        json.dump(objects, f, indent=2, sort_keys=True)
+
+    if len(warnings) == initial_warnings:
+        print('Successfully processed submission:  %s' % moodle_filename)
+    else:
+        print('Encountered WARNINGS on submission:  %s' % moodle_filename)
+
+    return (target_path, objects)
+
+
+def store_object(src_file):
+    '''
+    Copy a file into the object store, hashing it on the way.  If the store
+    already has a file with the same contents, the copy is thrown away.
+    Returns the hash of the file.
+    '''
+    if not os.path.isdir(OBJECTS_DIR):
+        try:
+            os.makedirs(OBJECTS_DIR)
+        except OSError:
+            # Another worker created it first.
+            pass
+
+    sha1 = hashlib.sha1()
+    (fd, tmp_path) = tempfile.mkstemp(dir=OBJECTS_DIR, prefix='.tmp')
+    with os.fdopen(fd, 'wb') as dst_file:
+        for chunk in iter(lambda: src_file.read(COPY_BUFFER_SIZE), ''):
+            sha1.update(chunk)
+            dst_file.write(chunk)
+
+    object_path = OBJECTS_DIR + '/' + sha1.hexdigest()
+    if os.path.exists(object_path):
+        os.remove(tmp_path)
+    else:
+        # mkstemp creates the file readable only by its owner; give it the
+        # permissions any other new file would have.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0666 & ~umask)
+        os.rename(tmp_path, object_path)
+    return sha1.hexdigest()
+
+
+def copy_object(sha1, path):
+    '''
+    Copy a file from the object store into a student's folder.  The file is
+    removed first, in case it is still a hard link into the store from an older
+    run, so writing the copy never changes the stored object.
+    '''
+    if os.path.lexists(path):
+        os.remove(path)
+    shutil.copyfile(OBJECTS_DIR + '/' + sha1, path)
+
+
+def read_submission(moodle_filename, files_to_extract, warnings):
+    '''
+    Read the required files from a student's Moodle submission into memory,
+    without extracting anything to disk.  Returns the student's username, the
+    name of the assignment and the contents of the files, keyed by filename.
+    Files missing from the archive are left out.
+    '''
+    (username, hwname, extension) = parse_submission_filename(moodle_filename)
+    contents = {}
+
+    def read_member(fname, src_file):
+        contents[fname] = src_file.read()
+
+    read_members(moodle_filename, extension, files_to_extract, read_member,
+                 warnings)
+    return (username, hwname, contents)
+
+
+def read_members(moodle_filename, extension, files_to_extract, handle_member,
+                 warnings):
+    '''
+    Open a Moodle submission archive (tar, zip or rar) and pass each required
+    file in it to handle_member, along with a file object to read it from.
+    '''
     # print('Extension = "%s"' % extension)
 
     if tarfile.is_tarfile(moodle_filename):
@@ -105,9 +227,13 @@ def process_submission(moodle_filename, files_to_extract, warnings):
 
         # print('Archive file names:  %s' % str(archive.getnames()))
 
+        index = index_members(
+            [m for m in archive.getmembers() if m.isfile()],
+            lambda m: m.name.split('/')[-1])
         for fname in files_to_extract:
             try:
-                extract_tar_member(moodle_filename, archive, fname, target_path)
+                extract_member(moodle_filename, archive.extractfile, index,
+                               fname, handle_member)
             except SubmissionWarning as w:
                 warnings.append(w)
 
@@ -124,15 +250,19 @@ def process_submission(moodle_filename, files_to_extract, warnings):
 
         # print('Archive file names:  %s' % str(archive.namelist()))
 
+        index = index_members(archive.infolist(),
+                              lambda m: m.filename.split('/')[-1])
         for fname in files_to_extract:
             try:
-                extract_zip_member(moodle_filename, archive, fname, target_path)
+                extract_member(moodle_filename, archive.open, index, fname,
+                               handle_member)
             except SubmissionWarning as w:
                 warnings.append(w)
 
         archive.close()
 
-    elif rarfile.is_rarfile(moodle_filename):
+    elif is_rarfile(moodle_filename):
+        import rarfile
 
         if extension != 'rar' or \
            (extension.endswith('.rar') and extension.contains('rar')):
@@ -143,9 +273,12 @@ def process_submission(moodle_filename, files_to_extract, warnings):
 
         # print('Archive file names:  %s' % str(archive.namelist()))
 
+        index = index_members(archive.infolist(),
+                              lambda m: m.filename.split('\\')[-1])
         for fname in files_to_extract:
             try:
-                extract_rar_member(moodle_filename, archive, fname, target_path)
+                extract_member(moodle_filename, archive.open, index, fname,
+                               handle_member)
             except SubmissionWarning as w:
                 warnings.append(w)
 
@@ -154,83 +287,220 @@ def process_submission(moodle_filename, files_to_extract, warnings):
     else:
         raise SubmissionError(moodle_filename, 'Unrecognized archive format')
 
-    if len(warnings) == initial_warnings:
-        print('Successfully processed submission:  %s' % moodle_filename)
-    else:
-        print('Encountered WARNINGS on submission:  %s' % moodle_filename)
-
 
-def extract_tar_member(moodle_filename, archive, fname, target_path):
-    member = None
-    for m in archive.getmembers():
-        if not m.isfile():
-            continue
+def is_rarfile(moodle_filename):
+    '''
+    Check whether an archive is a RAR file.  The rarfile module is only needed
+    for RAR submissions, so it is only imported once one turns up.
+    '''
+    try:
+        import rarfile
+    except ImportError:
+        with open(moodle_filename, 'rb') as f:
+            if f.read(len(RAR_SIGNATURE)) == RAR_SIGNATURE:
+                raise SubmissionError(moodle_filename, 'The rarfile module ' \
+                    'is needed to read RAR archives.')
+        return False
+    return rarfile.is_rarfile(moodle_filename)
+
+
+def index_members(members, get_name):
+    '''
+    Index the members of an archive by their filename (without any folders),
+    so each required file can be found without scanning the whole archive.
+    '''
+    index = {}
+    for m in members:
+        index.setdefault(get_name(m), []).append(m)
+    return index
 
-        m_name = m.name.split('/')[-1]
-        if m_name == fname:
-            if member is not None:
-                raise SubmissionError(moodle_filename, 'Archive contains ' \
-                    'multiple copies of file "%s"!' % fname)
 
-            member = m
+def extract_member(moodle_filename, open_member, index, fname, handle_member):
+    '''
+    Find a required file in an archive and pass it to handle_member, along
+    with a file object that streams it out of the archive.  open_member opens
+    a member of the archive for reading.
+    '''
+    members = index.get(fname, [])
+    if len(members) > 1:
+        raise SubmissionError(moodle_filename, 'Archive contains ' \
+            'multiple copies of file "%s"!' % fname)
 
-    if member is None:
+    if len(members) == 0:
         raise SubmissionWarning(moodle_filename, 'Archive doesn\'t contain ' \
             'required file "%s"!' % fname)
 
-    src_file = archive.extractfile(member)
-    dst_file = open(target_path + '/' + fname, 'wb')
-    shutil.copyfileobj(src_file, dst_file)
+    src_file = open_member(members[0])
+    handle_member(fname, src_file)
     src_file.close()
-    dst_file.close()
 
 
-def extract_zip_member(moodle_filename, archive, fname, target_path):
-    member = None
-    for m in archive.infolist():
-        m_name = m.filename.split('/')[-1]
-        if m_name == fname:
-            if member is not None:
-                raise SubmissionError(moodle_filename, 'Archive contains ' \
-                    'multiple copies of file "%s"!' % fname)
+def archive_state(moodle_filename, previous=None):
+    '''
+    Get the size, modification time and hash of a Moodle archive.  The hash is
+    only computed if the size or modification time differ from the previous
+    state, since reading the whole archive is what we are trying to avoid.
+    '''
+    stat = os.stat(moodle_filename)
+    state = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    if previous is not None and previous.get('size') == state['size'] and \
+       previous.get('mtime') == state['mtime']:
+        state['sha1'] = previous.get('sha1')
+        return state
+
+    sha1 = hashlib.sha1()
+    with open(moodle_filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER_SIZE), ''):
+            sha1.update(chunk)
+    state['sha1'] = sha1.hexdigest()
+    return state
+
+
+def is_unchanged(state, previous, files_to_extract):
+    '''
+    Check whether an archive is the same as when it was last extracted, and
+    the files extracted from it are still there.
+    '''
+    if previous is None or previous.get('sha1') != state['sha1'] or \
+       previous.get('files') != files_to_extract:
+        return False
+    return all(os.path.exists(previous['target'] + '/' + fname)
+               for fname in previous.get('extracted', []))
 
-            member = m
 
-    if member is None:
-        raise SubmissionWarning(moodle_filename, 'Archive doesn\'t contain ' \
-            'required file "%s"!' % fname)
+def needs_unpacking(job):
+    '''
+    Check whether an archive has to be extracted, because extraction is forced
+    or it changed since the last run.  Archives that cannot be read have to be
+    extracted too, so the error is reported when they are.
+    '''
+    (moodle_filename, files_to_extract, previous, force) = job
+    if force:
+        return True
+    try:
+        state = archive_state(moodle_filename, previous)
+    except EnvironmentError:
+        return True
+    return not is_unchanged(state, previous, files_to_extract)
 
-    src_file = archive.open(member)
-    dst_file = open(target_path + '/' + fname, 'wb')
-    shutil.copyfileobj(src_file, dst_file)
-    src_file.close()
-    dst_file.close()
+
+def unpack(job):
+    '''
+    Extract a single Moodle archive, unless it is unchanged since the last run.
+    This runs in a worker process, so everything it returns must be picklable:
+    a tuple of (filename, status, new state, warnings, error, seconds), where
+    status is one of 'extracted', 'skipped' or 'failed'.
+    '''
+    (moodle_filename, files_to_extract, previous, force) = job
+    start = time.time()
+    warnings = []
+    try:
+        state = archive_state(moodle_filename, previous)
+        if not force and is_unchanged(state, previous, files_to_extract):
+            print('Skipping unchanged submission:  %s' % moodle_filename)
+            state = dict(previous, **state)
+            return (moodle_filename, 'skipped', state,
+                    previous.get('warnings', []), None, time.time() - start)
+
+        (state['target'], state['objects']) = process_submission(
+            moodle_filename, files_to_extract, warnings)
+        state['files'] = files_to_extract
+        state['extracted'] = [fname for fname in files_to_extract
+                              if os.path.exists(state['target'] + '/' + fname)]
+        state['warnings'] = [str(w) for w in warnings]
+        return (moodle_filename, 'extracted', state, state['warnings'], None,
+                time.time() - start)
+
+    except (SubmissionError, EnvironmentError) as e:
+        return (moodle_filename, 'failed', None, [str(w) for w in warnings],
+                str(e), time.time() - start)
+
+
+def unpack_group(jobs):
+    '''
+    Extract the archives of a single student one after the other, in the order
+    given, so when a student submitted more than one archive the last one wins.
+    If any of them has to be extracted, they all are, since the earlier ones
+    would otherwise overwrite the files of the later ones that were skipped.
+    Returns the result of unpack for each archive.
+    '''
+    if any(needs_unpacking(job) for job in jobs):
+        jobs = [job[:3] + (True,) for job in jobs]
+    return [unpack(job) for job in jobs]
 
 
-def extract_rar_member(moodle_filename, archive, fname, target_path):
-    member = None
-    for m in archive.infolist():
-        m_name = m.filename.split('\\')[-1]
-        if m_name == fname:
-            if member is not None:
-                raise SubmissionError(moodle_filename, 'Archive contains ' \
-                    'multiple copies of file "%s"!' % fname)
+def group_by_student(jobs):
+    '''
+    Group the jobs by the folder the archives are extracted into, keeping the
+    jobs in their original order within each group.  Archives whose names
+    cannot be parsed are put in a group of their own.
+    '''
+    groups = collections.OrderedDict()
+    for job in jobs:
+        try:
+            (username, hwname, _) = parse_submission_filename(job[0])
+            key = (username, hwname)
+        except SubmissionError:
+            key = job[0]
+        groups.setdefault(key, []).append(job)
+    return list(groups.values())
 
-            member = m
 
-    if member is None:
-        raise SubmissionWarning(moodle_filename, 'Archive doesn\'t contain ' \
-            'required file "%s"!' % fname)
+def load_manifest():
+    '''
+    Load the state of each archive from the last run.
+    '''
+    try:
+        with open(MANIFEST_FILENAME) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
 
-    src_file = archive.open(member)
-    dst_file = open(target_path + '/' + fname, 'wb')
-    shutil.copyfileobj(src_file, dst_file)
-    src_file.close()
-    dst_file.close()
+
+def save_manifest(manifest):
+    '''
+    Save the state of each archive, replacing the manifest atomically so an
+    interrupted run never leaves a half-written one behind.
+    '''
+    if not os.path.isdir(os.path.dirname(MANIFEST_FILENAME)):
+        os.makedirs(os.path.dirname(MANIFEST_FILENAME))
+    with open(MANIFEST_FILENAME + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(MANIFEST_FILENAME + '.tmp', MANIFEST_FILENAME)
+
+
+def print_timings(results, seconds):
+    '''
+    Print how long each archive took, slowest first, and a summary.
+    '''
+    print('\nTime per submission (slowest first):')
+    for result in sorted(results, key=lambda r: -r[5]):
+        print('  %8.3fs  %-9s %s' % (result[5], result[1], result[0]))
+
+    counts = {}
+    for result in results:
+        counts[result[1]] = counts.get(result[1], 0) + 1
+    print('\n%d submissions in %.2fs:  %d extracted, %d skipped, %d failed' % \
+        (len(results), seconds, counts.get('extracted', 0),
+         counts.get('skipped', 0), counts.get('failed', 0)))
+
+    hashes = [sha1 for result in results if result[2] is not None
+              for sha1 in result[2].get('objects', {}).itervalues()]
+    print('%d files stored as %d distinct objects in %s' % \
+        (len(hashes), len(set(hashes)), OBJECTS_DIR))
 
 
 if __name__ == '__main__':
-    spec_filename = sys.argv[1]
+    parser = argparse.ArgumentParser(description='Extract the files named ' \
+        'in an assignment spec from the Moodle archives listed on stdin.')
+    parser.add_argument('spec_filename', help='The assignment spec file')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of archives to extract in parallel')
+    parser.add_argument('--force', action='store_true',
+                        help='Extract archives even if they are unchanged ' \
+                             'since the last run')
+    args = parser.parse_args()
+    spec_filename = args.spec_filename
 
     print('Loading specification file "%s".' % spec_filename)
     spec_json = load_spec_file(spec_filename)
@@ -244,22 +514,40 @@ if __name__ == '__main__':
     print
 
     moodle_filenames = sys.stdin.readlines()
-    moodle_filenames = set(moodle_filenames)
+    moodle_filenames = set([line.strip() for line in moodle_filenames])
+    moodle_filenames.discard('')
     moodle_filenames = list(moodle_filenames)
     moodle_filenames.sort()
 
+    manifest = load_manifest()
+    jobs = [(line, files_to_extract, manifest.get(line), args.force)
+            for line in moodle_filenames]
+
+    start = time.time()
+    # Archives of the same student extract into the same folder, so they are
+    # extracted together (by the same worker).
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs)
+        results = pool.map(unpack_group, group_by_student(jobs), 1)
+        pool.close()
+        pool.join()
+    else:
+        results = map(unpack_group, group_by_student(jobs))
+    order = dict((job[0], i) for (i, job) in enumerate(jobs))
+    results = sorted([result for group in results for result in group],
+                     key=lambda result: order[result[0]])
+
     bad_lines = []
     warnings = []
-
-    for line in moodle_filenames:
-        line = line.strip()
-        if len(line) == 0:
-            continue
-
-        try:
-            process_submission(line, files_to_extract, warnings)
-        except SubmissionError as e:
-            bad_lines.append(str(e))
+    for (line, status, state, submission_warnings, error, _) in results:
+        if state is not None:
+            manifest[line] = state
+        else:
+            manifest.pop(line, None)
+        if error is not None:
+            bad_lines.append(error)
+        warnings += submission_warnings
+    save_manifest(manifest)
 
     if len(bad_lines) > 0:
         print('\nCould not process these submissions:')
@@ -271,3 +559,4 @@ if __name__ == '__main__':
         for warn in warnings:
             print(' * %s' % str(warn))
 
+    print_timings(results, time.time() - start)
@@ -0,0 +1,232 @@
+"""
+Module: verdicts
+----------------
+A persistent store of graded output for student responses. The same response
+to the same problem, run against the same database, always gets the same
+result, so responses that have been seen before (in an earlier run or even an
+earlier semester) do not need to be run against the database again.
+
+Usage: python verdicts.py --size
+       python verdicts.py --prune <days>
+       python verdicts.py --invalidate <assignment> [<file>|<problem> ...]
+"""
+import argparse
+import json
+import sqlite3
+import time
+
+import iotools
+from CONFIG import VERDICT_STORE
+
+def get_problems(specs):
+  """
+  Function: get_problems
+  ----------------------
+  Gets all the problems in the specs.
+
+  specs: The specs for the assignment.
+  returns: A list of tuples of the form (file, problem specs).
+  """
+  problems = []
+  for f in specs["files"]:
+    filespec = specs[f]
+    if isinstance(filespec, dict):
+      filespec = filespec["tests"]
+    problems += [(f, problem) for problem in filespec]
+  return problems
+
+
+def problem_key(specs, filename, problem):
+  """
+  Function: problem_key
+  ---------------------
+  Gets the hash of the compiled specs for a problem. This includes everything
+  in the specs that can change the result of grading the problem: the problem
+  and its tests, as well as the setup for the file and the assignment.
+
+  specs: The specs for the assignment.
+  filename: The file the problem is in.
+  problem: The specs for the problem.
+  returns: The hash as a hex string.
+  """
+  filespec = specs[filename]
+  file_setup = filespec.get("setup") if isinstance(filespec, dict) else None
+  return iotools.fingerprint(specs.get("setup"), filename, file_setup, problem)
+
+
+class VerdictStore:
+  """
+  Class: VerdictStore
+  -------------------
+  The persistent store of graded output, backed by a SQLite database. Each entry
+  is keyed by a hash of the compiled problem specs, the canonical response,
+  and the fingerprint of the database it was graded against.
+  """
+
+  def __init__(self, filename=VERDICT_STORE):
+    # The connection to the store.
+    self.db = sqlite3.connect(filename)
+    self.db.execute(
+      "CREATE TABLE IF NOT EXISTS verdicts ("
+      "  key TEXT PRIMARY KEY,"
+      "  assignment TEXT,"
+      "  problem TEXT,"
+      "  spec TEXT,"
+      "  output TEXT,"
+      "  created REAL,"
+      "  used REAL)"
+    )
+    self.db.execute(
+      "CREATE INDEX IF NOT EXISTS verdicts_problem ON verdicts "
+      "(assignment, problem)"
+    )
+
+
+  def close(self):
+    """
+    Function: close
+    ---------------
+    Commits any new entries and closes the store.
+    """
+    self.db.commit()
+    self.db.close()
+
+
+  def commit(self):
+    """
+    Function: commit
+    ----------------
+    Commits any new entries to the store.
+    """
+    self.db.commit()
+
+
+  def get(self, key):
+    """
+    Function: get
+    -------------
+    Gets the graded output for a key, and marks it as recently used.
+
+    key: The key for the entry.
+    returns: The graded output, None if the key does not exist.
+    """
+    row = self.db.execute("SELECT output FROM verdicts WHERE key=?",
+                          (key,)).fetchone()
+    if row is None:
+      return None
+    self.db.execute("UPDATE verdicts SET used=? WHERE key=?",
+                    (time.time(), key))
+    return iotools.load_json(row[0])
+
+
+  def invalidate(self, assignment, problems=None, specs=None):
+    """
+    Function: invalidate
+    --------------------
+    Removes entries for an assignment. Either removes the entries for specific
+    problems, or the entries for problems whose specs have changed.
+
+    assignment: The assignment.
+    problems: The problems to remove, in the form <file>|<problem number>.
+    specs: The current specs for the assignment. Entries graded with different
+           specs are removed.
+    returns: The number of entries removed.
+    """
+    removed = 0
+    if problems is not None:
+      for problem in problems:
+        removed += self.db.execute(
+          "DELETE FROM verdicts WHERE assignment=? AND problem=?",
+          (assignment, problem)
+        ).rowcount
+
+    if specs is not None:
+      for (f, problem) in get_problems(specs):
+        removed += self.db.execute(
+          "DELETE FROM verdicts WHERE assignment=? AND problem=? AND spec!=?",
+          (assignment, f + "|" + problem["number"],
+           problem_key(specs, f, problem))
+        ).rowcount
+
+    self.db.commit()
+    return removed
+
+
+  def prune(self, days):
+    """
+    Function: prune
+    ---------------
+    Removes entries that have not been used within a number of days.
+
+    days: The number of days.
+    returns: The number of entries removed.
+    """
+    removed = self.db.execute("DELETE FROM verdicts WHERE used<?",
+                              (time.time() - days * 24 * 60 * 60,)).rowcount
+    self.db.commit()
+    self.db.execute("VACUUM")
+    return removed
+
+
+  def put(self, key, assignment, problem, spec, output):
+    """
+    Function: put
+    -------------
+    Puts an entry into the store.
+
+    key: The key for the entry.
+    assignment: The assignment the entry is for.
+    problem: The problem the entry is for, in the form <file>|<problem number>.
+    spec: The hash of the compiled problem specs.
+    output: The graded output to store.
+    """
+    now = time.time()
+    self.db.execute(
+      "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?)",
+      (key, assignment, problem, spec, json.dumps(output), now, now)
+    )
+
+
+  def size(self):
+    """
+    Function: size
+    --------------
+    Gets the size of the store.
+
+    returns: A list of tuples of the form (assignment, number of entries,
+             number of bytes of graded output).
+    """
+    return self.db.execute(
+      "SELECT assignment, COUNT(*), SUM(LENGTH(output)) FROM verdicts "
+      "GROUP BY assignment ORDER BY assignment"
+    ).fetchall()
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--size", action="store_const", const=True,
+                      help="Print the number of entries for each assignment")
+  parser.add_argument("--prune", type=float,
+                      help="Remove entries not used in this many days")
+  parser.add_argument("--invalidate", nargs="+",
+                      help="Of the form <assignment> [<file>|<problem> ...]. "
+                           "Removes the entries for the given problems, or if "
+                           "none are given, for problems whose specs have "
+                           "changed")
+  args = parser.parse_args()
+
+  store = VerdictStore()
+  if args.invalidate:
+    assignment = args.invalidate[0]
+    if len(args.invalidate) > 1:
+      removed = store.invalidate(assignment, problems=args.invalidate[1:])
+    else:
+      removed = store.invalidate(assignment,
+                                 specs=iotools.parse_specs(assignment))
+    print "Removed %d entries for %s." % (removed, assignment)
+  if args.prune is not None:
+    print "Removed %d unused entries." % store.prune(args.prune)
+  if args.size or not (args.invalidate or args.prune is not None):
+    for (assignment, entries, size) in store.size():
+      print "%s: %d entries (%d bytes)" % (assignment, entries, size)
+  store.close()